@@ -0,0 +1,22 @@
+import sounds
+from stage_file import Cities, PyxelTilemaps, ResourceFile, Tilemaps, RESOURCE_FILE
+from typing import Sequence
+from dataclasses import dataclass
+""" Audio and asset backends that GameState runs against """
+
+@dataclass(frozen=True)
+class Backend:
+    audio: sounds.Audio
+    tilemaps: Tilemaps
+
+def pyxel(resource: str = RESOURCE_FILE) -> Backend:
+    """ Plays sounds and loads levels through pyxel. Used by the BattleCity front end """
+    return Backend(sounds, PyxelTilemaps(resource))
+
+def headless(resource: str = RESOURCE_FILE) -> Backend:
+    """ Plays nothing and reads levels straight from the resource file, so GameState runs without a pyxel window """
+    return Backend(sounds.Silent(), ResourceFile(resource))
+
+def cities(cities: Sequence[Sequence[str]]) -> Backend:
+    """ Plays nothing and loads each level from a city given as rows of characters, such as a generated one """
+    return Backend(sounds.Silent(), Cities(cities))
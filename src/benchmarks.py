@@ -0,0 +1,505 @@
+import grid
+import main
+import backends
+import collision
+import stage_file
+import levelgen
+import gc
+import random
+import tracemalloc
+import argparse
+from dataclasses import dataclass, astuple
+from time import perf_counter
+from itertools import cycle
+from functools import partial
+from typing import Any, Callable, Iterator
+""" Performance benchmarks. Run with `python benchmarks.py [name ...]` from the src folder """
+
+BENCHMARKS: dict[str, Callable[[], None]] = {}
+
+def benchmark(func: Callable[[], None]):
+    """ Registers a benchmark under its function name """
+    BENCHMARKS[func.__name__] = func
+    return func
+
+def timeit(func: Callable[[], object], repeat: int = 200) -> float:
+    """ Returns the average time of a call in milliseconds """
+    start = perf_counter()
+    for _ in range(repeat): func()
+    return (perf_counter() - start)*1000/repeat
+
+def report(name: str, ms: float, baseline: float | None = None):
+    """ Prints a benchmark result, and its speedup over a baseline if given """
+    speedup = f"  ({baseline/ms:.1f}x)" if baseline else ''
+    print(f"  {name:<40}{ms:>10.4f} ms{speedup}")
+
+class LinearGridMap(grid.GridMap):
+    """ GridMap that finds objects by scanning the whole table, as it did before the reverse index """
+    def __contains__(self, obj: grid.GridObject) -> bool:
+        try:
+            self.find(obj)
+        except ValueError:
+            return False
+        return True
+
+    def find(self, obj: grid.GridObject) -> grid.Cell:
+        for r in range(self.rows):
+            for c in range(self.cols):
+                if self.table[r][c] == obj: return r - min(obj.R), c - min(obj.C)
+        raise ValueError('Gridmap does not have GridObject')
+
+def populate(gridmap: grid.GridMap, count: int, seed: int = 0) -> list[grid.GridObject]:
+    """ Places count 2x2 tanks on random free spots of the gridmap """
+    rng = random.Random(seed)
+    tanks: list[grid.GridObject] = []
+    while len(tanks) < count:
+        tank = grid.GridObject(range(2), range(2))
+        try:
+            gridmap.replace(rng.randrange(gridmap.rows - 1), rng.randrange(gridmap.cols - 1), tank)
+        except ValueError:
+            continue
+        tanks.append(tank)
+    return tanks
+
+def tank_frame(gridmap: grid.GridMap, tanks: list[grid.GridObject], moves: Iterator[tuple[int, int]]):
+    """ Mimics the per-frame grid work of GameState: membership test, locate and a clamped move for every tank """
+    for tank in tanks:
+        if tank not in gridmap: continue
+        r, c = gridmap.find(tank)
+        dr, dc = next(moves)
+        r, c = max(0, min(r + dr, gridmap.rows - 2)), max(0, min(c + dc, gridmap.cols - 2))
+        if all(other is tank for other in gridmap.scan(range(r, r + 2), range(c, c + 2))):
+            gridmap.move(tank, r, c)
+
+@benchmark
+def gridmap_find():
+    """ Per-frame cost of tank lookups and moves with and without the GridMap reverse index """
+    rng = random.Random(0)
+    steps = [rng.choice(((-1, 0), (1, 0), (0, -1), (0, 1))) for _ in range(4096)]
+    for count in (16, 50, 100, 150):
+        results: list[float] = []
+        for cls in (LinearGridMap, grid.GridMap):
+            gridmap = cls(32, 32, 256, 256)
+            tanks = populate(gridmap, count)
+            moves = cycle(steps)
+            results.append(timeit(lambda: tank_frame(gridmap, tanks, moves), 50))
+        print(f"{count} tanks")
+        report('table scan', results[0])
+        report('reverse index', results[1], results[0])
+
+def pixel_scan(gridmap: grid.GridMap, X: range, Y: range) -> Iterator[grid.GridObject]:
+    """ Scans a collider pixel by pixel, as GameState.scan did before the collision module """
+    for x in X:
+        for y in Y:
+            if 0 <= x < gridmap.width and 0 <= y < gridmap.height:
+                obj = gridmap.table[y//gridmap.cellheight][x//gridmap.cellwidth]
+                if obj is not None: yield obj
+
+def cell_scan(gridmap: grid.GridMap, X: range, Y: range) -> Iterator[grid.GridObject]:
+    """ Scans the cell range of a collider, as GameState.scan does """
+    R, C = collision.cells((X, Y), gridmap.cellwidth, gridmap.cellheight, gridmap.width, gridmap.height)
+    for c in C:
+        for r in R:
+            obj = gridmap.table[r][c]
+            if obj is not None: yield obj
+
+def pixel_overlap(collider1: collision.CollisionRect, collider2: collision.CollisionRect) -> bool:
+    """ Compares colliders pixel by pixel, as GameState.check_collision did before the collision module """
+    X1, Y1 = collider1
+    X2, Y2 = collider2
+    for x in X1:
+        for y in Y1:
+            if x in X2 and y in Y2: return True
+    return False
+
+@benchmark
+def bullet_collision():
+    """ Cost of a bullet's grid scan and a bullet-to-bullet check per collider size """
+    gridmap = grid.GridMap(32, 32, 256, 256)
+    for r in range(32):
+        for c in range(32):
+            if (r + c) % 3 == 0: gridmap.replace(r, c, grid.GridObject(range(1), range(1)))
+    colliders = {'Arrow 5x5': (range(5, 10), range(5, 10)), 'MagicArrow 8x11': (range(4, 12), range(2, 13)), '32x32': (range(0, 32), range(0, 32))}
+    for name, (X, Y) in colliders.items():
+        X, Y = range(X.start + 101, X.stop + 101), range(Y.start + 77, Y.stop + 77)
+        miss = range(X.start + 200, X.stop + 200), Y # Worst case for the pixel check: no overlap at all
+        print(name)
+        old = timeit(lambda: set(pixel_scan(gridmap, X, Y)), 2000)
+        report('scan: per pixel', old)
+        report('scan: cell range', timeit(lambda: set(cell_scan(gridmap, X, Y)), 2000), old)
+        old = timeit(lambda: pixel_overlap((X, Y), miss), 2000)
+        report('bullet check: per pixel', old)
+        report('bullet check: AABB', timeit(lambda: collision.overlaps((X, Y), miss), 2000), old)
+
+def arrow_field(count: int, seed: int = 0) -> dict[int, tuple[int, int, int, int]]:
+    """ Returns count arrows as id -> (x, y, dx, dy), spread over the map and flying in random directions """
+    rng = random.Random(seed)
+    return {n: (rng.randrange(256), rng.randrange(256), *rng.choice(((0, -4), (0, 4), (-4, 0), (4, 0)))) for n in range(count)}
+
+def arrow_collider(arrow: tuple[int, int, int, int]) -> collision.CollisionRect:
+    x, y, _, _ = arrow
+    return range(x + 5, x + 10), range(y + 5, y + 10)
+
+def bounce(arrow: tuple[int, int, int, int]) -> tuple[int, int, int, int]:
+    x, y, dx, dy = arrow
+    if not (0 <= x + dx < 256 and 0 <= y + dy < 256): dx, dy = -dx, -dy
+    return x + dx, y + dy, dx, dy
+
+def all_pairs_frame(arrows: dict[int, tuple[int, int, int, int]]) -> int:
+    """ Bullet-to-bullet pass as GameState.update did before the broadphase: every arrow against a copy of all arrows """
+    hits = 0
+    for n, arrow in arrows.copy().items():
+        for m in arrows.copy():
+            if m != n and collision.overlaps(arrow_collider(arrows[n]), arrow_collider(arrows[m])): hits += 1
+        arrows[n] = bounce(arrow)
+    return hits
+
+def broadphase_frame(arrows: dict[int, tuple[int, int, int, int]]) -> int:
+    """ Bullet-to-bullet pass through a per-frame spatial hash, as GameState.update does """
+    hits = 0
+    order = {n: i for i, n in enumerate(arrows)}
+    broadphase: collision.SpatialHash[int] = collision.SpatialHash(16)
+    for n, arrow in arrows.items(): broadphase.insert(n, arrow_collider(arrow))
+    for n, arrow in arrows.copy().items():
+        collider = arrow_collider(arrow)
+        for m in sorted(broadphase.query(collider), key=order.__getitem__):
+            if m != n and collision.overlaps(collider, arrow_collider(arrows[m])): hits += 1
+        arrows[n] = bounce(arrow)
+        broadphase.move(n, arrow_collider(arrows[n]))
+    return hits
+
+@benchmark
+def bullet_stress():
+    """ Frame cost of the bullet-to-bullet pass with hundreds of simultaneous arrows """
+    for count in (50, 100, 200, 400, 800):
+        print(f"{count} arrows")
+        baseline = None
+        if count <= 400: # All pairs takes seconds per frame past this
+            arrows = arrow_field(count)
+            baseline = timeit(lambda: all_pairs_frame(arrows), 5)
+            report(f"all pairs ({1000*baseline/count:.1f} us/arrow)", baseline)
+        arrows = arrow_field(count)
+        ms = timeit(lambda: broadphase_frame(arrows), 50)
+        report(f"spatial hash ({1000*ms/count:.1f} us/arrow)", ms, baseline)
+
+@benchmark
+def level_cache():
+    """ Cost of getting a level's spawn points, as every enemy wave and powerup spawn does """
+    tilemaps = stage_file.ResourceFile()
+    for level in range(1, main.MapLoader.LEVELS + 1):
+        print(f"level {level}")
+        old = timeit(lambda: stage_file.parse(stage_file.ResourceFile()[level]), 20)
+        report('reload resource file and parse', old)
+        report('read compiled pack', timeit(lambda: stage_file.read_pack(tilemaps.path), 200), old)
+        report('cached level', timeit(lambda: stage_file.load_level(level, tilemaps), 2000), old)
+
+@benchmark
+def headless_fps():
+    """ Simulation frames per second of a headless GameState on every level, with the player shooting """
+    backend = backends.headless()
+    for level in range(1, main.MapLoader.LEVELS + 1):
+        state = main.GameState(level, backend, seed=level)
+        frames = 3000
+        start = perf_counter()
+        for frame in range(frames):
+            if frame % 8 == 0 and state.player in state.gridmap and not state.player.shot: state.spawnBullet(state.player)
+            state.update()
+        print(f"  level {level}: {frames/(perf_counter() - start):>10.0f} frames/s")
+
+@benchmark
+def draw_calls():
+    """ Blits and drawspecs walk time per frame, drawing every tile versus the baked terrain layers """
+    backend = backends.headless()
+    for level in range(1, main.MapLoader.LEVELS + 1):
+        state = main.GameState(level, backend, seed=level)
+        for _ in range(300): state.update()
+        state.take_dirty_cells()
+        full = sum(1 for _ in state.drawspecs())
+        layered = sum(1 for _ in state.drawspecs(terrain = False)) + 2 # Plus one blt per baked layer
+        print(f"level {level}: {full} blits per frame drawing every tile, {layered} with the baked layers")
+        old = timeit(lambda: [(x, y, *texture) for x, y, texture in state.drawspecs()], 500)
+        report('walk every tile', old)
+        report('walk dynamic objects', timeit(lambda: [(x, y, *texture) for x, y, texture in state.drawspecs(terrain = False)], 500), old)
+
+@dataclass
+class DataclassTexture:
+    """ Texture as it was before it became a NamedTuple: unpacking it deep copies it through astuple """
+    img_bnk: int
+    x: int
+    y: int
+    w: int = 8
+    h: int = 8
+    colkey: int = 0
+
+    def __iter__(self):
+        return iter(astuple(self))
+
+def blt_args(specs: Iterator[tuple[int, int, object]]) -> list[tuple[int, ...]]:
+    """ Builds the px.blt arguments of every drawspec, like the draw loop does """
+    return [(x, y, *texture) for x, y, texture in specs] # type: ignore
+
+@benchmark
+def texture_args():
+    """ drawspecs walk and px.blt argument building per frame, with dataclass and NamedTuple textures """
+    state = main.GameState(3, backends.headless(), seed=3)
+    for _ in range(300): state.update()
+    specs = list(state.drawspecs())
+    legacy = [(x, y, DataclassTexture(*texture)) for x, y, texture in specs]
+    print(f"{len(specs)} sprites")
+    old = timeit(lambda: blt_args(iter(legacy)), 200)
+    report('blt args, dataclass + astuple', old)
+    report('blt args, NamedTuple', timeit(lambda: blt_args(iter(specs)), 200), old)
+    report('drawspecs walk + blt args', timeit(lambda: blt_args(state.drawspecs()), 200))
+
+class DictTile:
+    """ Terrain tile as it was before __slots__: a __dict__, its own ranges and its own Texture """
+    def __init__(self, r: int, c: int) -> None:
+        self._R, self._C = range(1), range(1)
+        self._texture = main.Texture(1, 8*(c%2), 8*(r%2))
+
+class SlotsTile(grid.GridObject):
+    """ Terrain tile as it was before the tile layer: a GridObject with __slots__, shared ranges and a shared texture """
+    __slots__ = ('_texture', '_hp')
+
+    def __init__(self, r: int, c: int) -> None:
+        super().__init__()
+        self._texture = main.tile_texture(8*(c%2), 8*(r%2))
+        self._hp = main.BRICK_HP
+
+TILES: dict[str, int] = {'B': main.BRICK, 'R': main.BRICK, 'W': main.WATER, 'S': main.STONE, 'T': main.TREE, 'L': main.MIRROR, 'J': main.MIRROR_POSITIVE}
+
+def tile_layer(cells: list[tuple[int, int, str]]) -> grid.TileLayer:
+    """ Returns a tile layer of the given terrain cells """
+    tiles = grid.TileLayer(main.ROWS, main.COLS)
+    for r, c, x in cells: tiles.place(r, c, TILES[x], main.BRICK_HP)
+    return tiles
+
+def allocated(build: Callable[[], object]) -> int:
+    """ Returns the bytes still held by what build returns """
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return size
+
+@benchmark
+def terrain_memory():
+    """ Memory held by each level's terrain tiles and by a whole GameState """
+    backend = backends.headless()
+    for level in range(1, main.MapLoader.LEVELS + 1):
+        cells = [(r, c, x) for r, row in enumerate(stage_file.load_level(level, backend.tilemaps).city) for c, x in enumerate(row) if x in TILES]
+        old = allocated(lambda: [DictTile(r, c) for r, c, _ in cells])
+        slots = allocated(lambda: [SlotsTile(r, c) for r, c, _ in cells])
+        layer = allocated(lambda: tile_layer(cells))
+        state = allocated(lambda: main.GameState(level, backend, seed=level))
+        print(f"  level {level}: {len(cells)} tiles, {old/1024:.1f} KiB with __dict__ tiles, {slots/1024:.1f} KiB with __slots__ tiles, "
+              f"{layer/1024:.1f} KiB as a tile layer, {state/1024:.1f} KiB per GameState")
+
+def legacy_rolls(rng: random.Random, count: int) -> list[tuple[str | None, bool]]:
+    """ Rolls enemy decisions one call at a time, as GameState.update did before enemy_rolls """
+    rolls: list[tuple[str | None, bool]] = []
+    for _ in range(count):
+        dir = None
+        if rng.random() < main.ENEMY_MOVEMENT_CHANCE:
+            choice = rng.choice(['N', 'W', 'S', 'E'])
+            if rng.random() < main.ENEMY_REDIRECT_CHANCE: dir = choice
+        rolls.append((dir, rng.random() < main.ENEMY_SHOOT_CHANCE))
+    return rolls
+
+@benchmark
+def enemy_ai():
+    """ Cost of rolling every enemy's AI decisions for a frame, one call at a time versus in one batch """
+    rng = random.Random(0)
+    for count in (10, 100, 1000):
+        old = timeit(lambda: legacy_rolls(rng, count), 200)
+        report(f"{count} enemies, per enemy calls", old)
+        report(f"{count} enemies, batched", timeit(lambda: list(main.enemy_rolls(rng, count)), 200), old)
+    samples = 10**6
+    for name, rolls in (('per enemy calls', legacy_rolls(rng, samples)), ('batched', list(main.enemy_rolls(rng, samples)))):
+        moves = [dir for dir, _ in rolls if dir is not None]
+        print(f"  {name}: moves {len(moves)/samples:.4f} (q*p = {main.ENEMY_MOVEMENT_CHANCE*main.ENEMY_REDIRECT_CHANCE:.4f}), "
+              f"shoots {sum(shoots for _, shoots in rolls)/samples:.4f} (r = {main.ENEMY_SHOOT_CHANCE:.4f}), "
+              f"directions {' '.join(f'{dir}:{moves.count(dir)/len(moves):.3f}' for dir in 'NWSE')}")
+
+@benchmark
+def pathfinding():
+    """ Cost of updating the castle distance field after each brick of a level is destroyed, from scratch versus incrementally """
+    backend = backends.headless()
+    for level in range(1, main.MapLoader.LEVELS + 1):
+        state = main.GameState(level, backend, seed=level, smart_enemies=True)
+        field, tiles = state.field, state.gridmap.tiles
+        assert field is not None
+        bricks = [cell for cell, code in tiles.enumerate() if code == main.BRICK]
+        build = timeit(field.rebuild, 20)
+        start = perf_counter()
+        for r, c in bricks:
+            tiles.remove(r, c)
+            field.open(r, c)
+        incremental = 1000*(perf_counter() - start)/len(bricks)
+        opened = field.distances
+        field.rebuild()
+        assert field.distances == opened, 'Incremental updates drifted from the rebuilt field'
+        print(f"level {level}: {len(bricks)} bricks, {sum(d != main.pathfinding.UNREACHABLE for d in opened)} reachable cells once they are all gone")
+        report('rebuild per brick', build)
+        report('open per brick', incremental, build)
+
+def arrows(**keywords: Any) -> partial[main.Bullet]:
+    """ Returns the bullet model of a tank that fires arrows made with the given keywords """
+    model: Callable[..., main.Bullet] = main.Arrow
+    return partial(model, **keywords)
+
+def shooting_range(speed: int, swept: bool) -> tuple[int, int]:
+    """
+    Fires arrows of the given speed up an empty level, once at a row of bricks and once at an oncoming arrow, from every column.
+    Returns how many arrows hit the bricks and how many met the oncoming arrow. Bullets only test where they end up each frame unless swept
+    """
+    backend = backends.headless()
+    extent = main.GameState.bullet_extent
+    if not swept: main.GameState.bullet_extent = lambda self, bullet: bullet.speed # type: ignore # One step per frame
+    bricks = met = 0
+    for c in range(0, main.COLS - 1, 2):
+        for target in ('bricks', 'arrow'):
+            state = main.GameState(1, backend, seed=1)
+            tiles = state.gridmap.tiles
+            for tank in state.enemies: state.gridmap.remove(tank)
+            state.enemies.clear()
+            for cell, _ in list(tiles.enumerate()): tiles.remove(*cell)
+            for obj in dict.fromkeys(state.gridmap): state.gridmap.remove(obj)
+            shooter, other = main.FriendTank(), main.EnemyTank()
+            state.gridmap.replace(main.ROWS - 2, c, shooter)
+            shooter.bullet = arrows(speed = speed)
+            if target == 'bricks': 
+                for col in range(main.COLS): tiles.place(main.ROWS//2, col, main.BRICK, 1)
+            else: 
+                state.gridmap.replace(0, c, other)
+                other.bullet = arrows(hostile = True, speed = speed)
+                state.spawnBullet(other)
+            state.spawnBullet(shooter)
+            for _ in range(main.DISPLAY_HEIGHT//(speed//main.TICK_RATE)): # Less than a round trip
+                state.update()
+                if target == 'bricks' and any(tiles.code(main.ROWS//2, col) == 0 for col in range(main.COLS)): 
+                    bricks += 1
+                    break
+                if target == 'arrow' and not state.bullets: # Tanks that aren't enemies or the player don't stop arrows, so only the arrows themselves can
+                    met += 1
+                    break
+    main.GameState.bullet_extent = extent # type: ignore
+    return bricks, met
+
+@benchmark
+def swept_collision():
+    """ Arrows that hit a one-brick wall and an oncoming arrow at rising speeds, testing only end positions versus sweeping each frame's path """
+    for speed in (240, 480, 960, 1920, 3840):
+        shots = (main.COLS + 1)//2
+        (bricks, met), (swept_bricks, swept_met) = shooting_range(speed, False), shooting_range(speed, True)
+        print(f"  {speed:>4} px/s ({speed//main.TICK_RATE:>2} px/tick): end positions hit {bricks}/{shots} walls and {met}/{shots} arrows, swept {swept_bricks}/{shots} and {swept_met}/{shots}")
+
+def firefight(state: main.GameState, frames: int):
+    """ Plays frames with every tank firing again as soon as its bullet is spent """
+    for _ in range(frames):
+        for tank in (state.player, *state.enemies):
+            if tank in state.gridmap and not tank.shot: state.spawnBullet(tank)
+        state.update()
+
+@benchmark
+def pooling():
+    """ Allocations and garbage collections of a heavy firefight with and without bullet and explosion pools """
+    backend = backends.headless()
+    capacity, frames = main.POOL_CAPACITY, 3000
+    for label, main.POOL_CAPACITY in (('no pools', 0), ('pools', capacity)): # type: ignore # Pools are sized when a GameState is made
+        state = main.GameState(3, backend, seed=3)
+        gc.collect()
+        before = sum(stats['collections'] for stats in gc.get_stats())
+        start = perf_counter()
+        firefight(state, frames)
+        ms = 1000*(perf_counter() - start)/frames
+        collections = sum(stats['collections'] for stats in gc.get_stats()) - before
+        created = sum(pool.created for pool in state.pools)
+        reused = sum(pool.reused for pool in state.pools)
+        print(f"  {label}: {created} bullets and explosions created, {reused} reused, {collections} gc collections, {ms:.3f} ms/frame")
+    main.POOL_CAPACITY = capacity # type: ignore
+
+def tiled_city(city: tuple[str, ...], blocks: int) -> list[str]:
+    """ Repeats the terrain of a city blocks x blocks times. Tanks, the castle and spawns stay in the first copy only """
+    terrain = [''.join('.' if char in 'PEC*' else char for char in row) for row in city]
+    rows = [row + terrain[r]*(blocks - 1) for r, row in enumerate(city)]
+    return rows + [row*blocks for _ in range(blocks - 1) for row in terrain]
+
+def park(gridmap: grid.GridMap, size: int) -> int:
+    """ Parks a tank on the first free spot of every size x size block of a map, so the map holds objects outside the view too. Returns how many were parked """
+    parked = 0
+    for r0 in range(0, gridmap.rows, size):
+        for c0 in range(0, gridmap.cols, size):
+            for r, c in ((r, c) for r in range(r0, r0 + size - 1) for c in range(c0, c0 + size - 1)):
+                try: gridmap.replace(r, c, main.EnemyTank())
+                except ValueError: continue
+                parked += 1
+                break
+    return parked
+
+@benchmark
+def map_size():
+    """ Time per frame of the simulation and of walking the draw specs, on maps of growing size, for the whole map versus only the view """
+    city = stage_file.load_level(1, backends.headless().tilemaps).city
+    for blocks in (1, 2, 4, 8):
+        state = main.GameState(1, backends.cities([city, tiled_city(city, blocks)]), seed=1)
+        parked = park(state.gridmap, len(city))
+        view = range(main.DISPLAY_WIDTH), range(main.DISPLAY_HEIGHT)
+        print(f"  {state.gridmap.rows}x{state.gridmap.cols} cells, {parked} tanks parked across the map")
+        report('update', timeit(state.update, 300))
+        old = timeit(lambda: [(x, y, *texture) for x, y, texture in state.drawspecs(terrain = False)], 100)
+        report('walk the whole map', old)
+        report('walk the view', timeit(lambda: [(x, y, *texture) for x, y, texture in state.drawspecs(terrain = False, view = view)], 100), old)
+
+@benchmark
+def chunked_map():
+    """ Load time, memory held and time per frame of a firefight on huge maps, holding all of the terrain versus chunks of it near the tanks """
+    city = stage_file.load_level(1, backends.headless().tilemaps).city
+    limit, frames = main.CHUNKED_MAP_CELLS, 300
+    for blocks in (4, 8, 16):
+        big = tiled_city(city, blocks)
+        print(f"  {len(big)}x{len(big[0])} cells")
+        for label, main.CHUNKED_MAP_CELLS in (('whole map', len(big)*len(big[0])), ('chunks', 0)): # type: ignore # Read when a level is loaded
+            if blocks > 8 and main.CHUNKED_MAP_CELLS: continue # Takes too long to load whole
+            gc.collect()
+            tracemalloc.start()
+            start = perf_counter()
+            state = main.GameState(1, backends.cities([city, big]), seed=1)
+            load = 1000*(perf_counter() - start)
+            start = perf_counter()
+            firefight(state, frames)
+            ms = 1000*(perf_counter() - start)/frames
+            held, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            tiles = state.gridmap.tiles
+            chunked = f", {len(tiles.loaded)} chunks in memory, {tiles.loads} loads, {tiles.store.size} bytes on disk" if state.chunked else '' # type: ignore
+            print(f"    {label}: loaded in {load:.1f} ms, {held/1024:.0f} KiB held, {ms:.3f} ms/frame{chunked}")
+    main.CHUNKED_MAP_CELLS = limit # type: ignore
+
+@benchmark
+def generated_cities():
+    """ Random cities generated and checked per second, and time per frame of a firefight on some of them """
+    for rows, cols in ((32, 32), (64, 64), (128, 128)):
+        count = 8192//(rows*cols//1024)
+        start = perf_counter()
+        cities = [levelgen.generate(seed, rows, cols) for seed in range(count)]
+        seconds = perf_counter() - start
+        start = perf_counter()
+        for city in cities: levelgen.check(city)
+        print(f"  {rows}x{cols}: {count/seconds:.0f} cities/s generated, {count/(perf_counter() - start):.0f} cities/s checked")
+    frames, cities = 300, [levelgen.generate(seed) for seed in range(8)]
+    start = perf_counter()
+    for level in range(1, len(cities)): firefight(main.GameState(level, backends.cities(cities), seed=level), frames)
+    print(f"  firefight on {len(cities) - 1} generated cities: {1000*(perf_counter() - start)/(frames*(len(cities) - 1)):.3f} ms/frame")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs the performance benchmarks")
+    parser.add_argument('names', nargs='*', metavar='name', help=f"benchmarks to run, any of {', '.join(BENCHMARKS)} (default: all)")
+    names = parser.parse_args().names or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS: parser.error(f"unknown benchmark {name!r}")
+    for name in names:
+        print(f"[{name}] {(BENCHMARKS[name].__doc__ or '').strip()}")
+        BENCHMARKS[name]()
@@ -0,0 +1,202 @@
+import grid
+import zlib
+import hashlib
+import tempfile
+from array import array
+from collections import OrderedDict
+from typing import IO, Callable, Final, Iterable, Iterator
+""" Terrain split into fixed-size chunks, so only the parts of a huge map near the action are held in memory """
+
+CHUNK: Final[int] = 32 # Cells per side of a chunk
+
+Source = Callable[[range, range], Iterator[tuple[grid.Cell, int, int]]] # Yields the (cell, code, hp) of every tile of a level within rows and cols
+
+def nothing(R: range, C: range) -> Iterator[tuple[grid.Cell, int, int]]:
+    """ Source of a layer without tiles """
+    return iter(())
+
+def digest(chunk: grid.TileLayer) -> bytes:
+    """ Returns a digest of the codes and hitpoints of a chunk """
+    return hashlib.blake2b(chunk.codes.tobytes() + chunk.hitpoints.tobytes(), digest_size=8).digest()
+
+class ChunkStore:
+    """
+    Compact on-disk form of evicted chunks: their codes and hitpoints, zlib-compressed into one temporary file.
+    Saving a chunk again appends a new copy, and the space of older copies is only given back when the store is closed.
+    The file is only created once the first chunk is saved.
+    """
+    def __init__(self) -> None:
+        self._file: IO[bytes] | None = None
+        self._index: dict[grid.Cell, tuple[int, int, bytes]] = {} # Offset, length and digest of the latest copy of each chunk
+        self._size = 0
+
+    def __contains__(self, key: grid.Cell) -> bool:
+        return key in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def keys(self):
+        """ Returns the keys of the stored chunks """
+        return self._index.keys()
+
+    @property
+    def size(self):
+        """ Returns the number of bytes written to disk """
+        return self._size
+
+    def digest(self, key: grid.Cell) -> bytes:
+        """ Returns the digest of a stored chunk, without reading it back from disk """
+        return self._index[key][2]
+
+    def save(self, key: grid.Cell, chunk: grid.TileLayer):
+        """ Writes a chunk to disk """
+        data = zlib.compress(chunk.codes.tobytes() + chunk.hitpoints.tobytes())
+        if self._file is None: self._file = tempfile.TemporaryFile()
+        self._file.seek(self._size)
+        self._file.write(data)
+        self._index[key] = self._size, len(data), digest(chunk)
+        self._size += len(data)
+
+    def load(self, key: grid.Cell, rows: int, cols: int) -> grid.TileLayer:
+        """ Reads a rows x cols chunk back from disk """
+        offset, length, _ = self._index[key]
+        assert self._file is not None # Only saved chunks are in the index
+        self._file.seek(offset)
+        data = zlib.decompress(self._file.read(length))
+        chunk = grid.TileLayer(rows, cols)
+        chunk.codes[:] = array('B', data[:rows*cols])
+        chunk.hitpoints[:] = array('b', data[rows*cols:])
+        return chunk
+
+    def close(self):
+        """ Deletes the file and forgets every stored chunk """
+        if self._file is not None: self._file.close()
+        self._file = None
+        self._index.clear()
+        self._size = 0
+
+class ChunkedTileLayer:
+    """
+    A TileLayer split into size x size chunks. A chunk is read from the level's source the first time a cell of it is looked at, and at most capacity chunks are held in memory.
+    keep() evicts the chunks far from where the action is. Evicted chunks that changed are written to a ChunkStore and come back from there, the others are read from the source again.
+    """
+    def __init__(self, rows: int, cols: int, source: Source = nothing, size: int = CHUNK, capacity: int = 64) -> None:
+        self._rows = rows
+        self._cols = cols
+        self._source = source
+        self._size = size
+        self._capacity = max(capacity, 1)
+        self._chunks: OrderedDict[grid.Cell, grid.TileLayer] = OrderedDict() # Chunks in memory, the least recently kept first
+        self._changed: set[grid.Cell] = set() # Chunks in memory that differ from their last stored or sourced copy
+        self._store = ChunkStore()
+        self.loads = 0
+        self.evictions = 0
+
+    @property
+    def size(self):
+        """ Returns the number of cells per side of a chunk """
+        return self._size
+    @property
+    def loaded(self):
+        """ Returns the keys of the chunks in memory """
+        return self._chunks.keys()
+    @property
+    def store(self): return self._store
+
+    def chunk_of(self, r: int, c: int) -> grid.Cell:
+        """ Returns the key of the chunk that holds cell """
+        return r//self._size, c//self._size
+
+    def clear(self):
+        """ Empties the layer. Tiles are no longer read from the source """
+        self.close()
+        self._source = nothing
+
+    def close(self):
+        """ Lets go of the chunks in memory and deletes the stored ones, for a layer that is discarded """
+        self._chunks.clear()
+        self._changed.clear()
+        self._store.close()
+
+    def code(self, r: int, c: int) -> int:
+        """ Returns the tile code at cell, 0 if empty """
+        size = self._size
+        return self._chunk((r//size, c//size)).code(r % size, c % size)
+
+    def hp(self, r: int, c: int) -> int:
+        """ Returns the hitpoints of the tile at cell """
+        size = self._size
+        return self._chunk((r//size, c//size)).hp(r % size, c % size)
+
+    def place(self, r: int, c: int, code: int, hp: int = 0):
+        """ Puts a tile on a cell """
+        size = self._size
+        self._chunk(key := (r//size, c//size)).place(r % size, c % size, code, hp)
+        self._changed.add(key)
+
+    def hit(self, r: int, c: int, pts: int = 1) -> int:
+        """ Takes hitpoints from the tile at cell and returns what is left """
+        size = self._size
+        self._changed.add(key := (r//size, c//size))
+        return self._chunk(key).hit(r % size, c % size, pts)
+
+    def remove(self, r: int, c: int):
+        """ Empties a cell """
+        self.place(r, c, 0)
+
+    def blocked(self, R: range, C: range) -> bool:
+        """ Returns True if any cell of the subgrid within bounds has a tile """
+        C = range(max(C.start, 0), min(C.stop, self._cols))
+        return any(self.code(r, c) for r in range(max(R.start, 0), min(R.stop, self._rows)) for c in C)
+
+    def enumerate(self, loaded: bool = False) -> Iterator[tuple[grid.Cell, int]]:
+        """ 
+        Enumerates all tiles with their cells, chunk by chunk. Every chunk is looked at, so this is slow on huge maps.
+        Only the tiles of the chunks in memory are enumerated if loaded is set, and none are loaded
+        """
+        if loaded: keys: Iterable[grid.Cell] = sorted(self._chunks)
+        else: keys = ((cr, cc) for cr in range(-(-self._rows//self._size)) for cc in range(-(-self._cols//self._size)))
+        for cr, cc in keys:
+            for (r, c), code in self._chunk((cr, cc)).enumerate():
+                yield (cr*self._size + r, cc*self._size + c), code
+
+    def changes(self) -> list[tuple[grid.Cell, bytes]]:
+        """ 
+        Returns the key and digest of every chunk that changed since the layer was read from its source, in key order.
+        Stored chunks are hashed when they are saved and chunks in memory as they are, so no chunk is loaded
+        """
+        keys = sorted(self._changed | self._store.keys())
+        return [(key, digest(chunk) if (chunk := self._chunks.get(key)) is not None else self._store.digest(key)) for key in keys]
+
+    def keep(self, cells: Iterable[grid.Cell], radius: int = 1):
+        """ Evicts every chunk in memory that is more than radius chunks away from all of the cells """
+        size, around = self._size, range(-radius, radius + 1)
+        wanted = {(cr + dr, cc + dc) for cr, cc in {(r//size, c//size) for r, c in cells} for dr in around for dc in around} # Tanks tend to share chunks
+        for key in [key for key in self._chunks if key not in wanted]: self._evict(key)
+        for key in self._chunks.keys() & wanted: self._chunks.move_to_end(key) # Kept chunks are the last to go when over capacity
+
+    def _chunk(self, key: grid.Cell) -> grid.TileLayer:
+        """ Returns a chunk, loading it if it isn't in memory """
+        chunk = self._chunks.get(key)
+        return chunk if chunk is not None else self._load(key)
+
+    def _load(self, key: grid.Cell) -> grid.TileLayer:
+        while len(self._chunks) >= self._capacity: self._evict(next(iter(self._chunks)))
+        cr, cc = key
+        R = range(cr*self._size, min((cr + 1)*self._size, self._rows))
+        C = range(cc*self._size, min((cc + 1)*self._size, self._cols))
+        if key in self._store: chunk = self._store.load(key, len(R), len(C))
+        else:
+            chunk = grid.TileLayer(len(R), len(C))
+            for (r, c), code, hp in self._source(R, C): chunk.place(r - R.start, c - C.start, code, hp)
+        self._chunks[key] = chunk
+        self.loads += 1
+        return chunk
+
+    def _evict(self, key: grid.Cell):
+        chunk = self._chunks.pop(key)
+        if key in self._changed:
+            self._store.save(key, chunk)
+            self._changed.discard(key)
+        self.evictions += 1
@@ -0,0 +1,74 @@
+from typing import Generic, Hashable, TypeAlias, TypeVar
+""" Axis-aligned rectangle (AABB) collision helpers. Rectangles are (X, Y) pairs of half-open pixel ranges """
+
+CollisionRect: TypeAlias = tuple[range, range]
+T = TypeVar('T', bound=Hashable)
+
+def overlaps(collider1: CollisionRect, collider2: CollisionRect) -> bool:
+    """ Returns True if two colliders share at least one pixel """
+    (X1, Y1), (X2, Y2) = collider1, collider2
+    return (X1.start < X1.stop and Y1.start < Y1.stop and X2.start < X2.stop and Y2.start < Y2.stop # Empty colliders never collide
+            and X1.start < X2.stop and X2.start < X1.stop
+            and Y1.start < Y2.stop and Y2.start < Y1.stop)
+
+def span(P: range, size: int, limit: int) -> range:
+    """ Returns the range of cells of the given size that a range of pixels touches, clamped to [0, limit) pixels """
+    lo, hi = max(P.start, 0), min(P.stop, limit)
+    if lo >= hi: return range(0)
+    return range(lo//size, (hi - 1)//size + 1)
+
+def cells(collider: CollisionRect, cellwidth: int, cellheight: int, width: int, height: int) -> tuple[range, range]:
+    """ Returns the (rows, columns) of cells a collider touches within a width x height pixel area """
+    X, Y = collider
+    return span(Y, cellheight, height), span(X, cellwidth, width)
+
+class SpatialHash(Generic[T]):
+    """
+    A uniform grid broadphase that buckets colliders by the square cells they touch.
+    Querying a collider only returns items sharing a cell with it, so only nearby pairs need an exact overlap test.
+    """
+    def __init__(self, cellsize: int = 16) -> None:
+        self._cellsize = cellsize
+        self._buckets: dict[tuple[int, int], set[T]] = {}
+        self._keys: dict[T, list[tuple[int, int]]] = {}
+
+    @property
+    def cellsize(self): return self._cellsize
+
+    def __contains__(self, item: T) -> bool:
+        return item in self._keys
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def _cells(self, collider: CollisionRect) -> list[tuple[int, int]]:
+        X, Y = collider
+        if X.start >= X.stop or Y.start >= Y.stop: return []
+        size = self._cellsize
+        return [(i, j) for i in range(X.start//size, (X.stop - 1)//size + 1) for j in range(Y.start//size, (Y.stop - 1)//size + 1)]
+
+    def insert(self, item: T, collider: CollisionRect):
+        """ Adds an item with its collider """
+        keys = self._keys[item] = self._cells(collider)
+        for key in keys:
+            if key in self._buckets: self._buckets[key].add(item)
+            else: self._buckets[key] = {item}
+
+    def remove(self, item: T):
+        """ Removes an item. Does nothing if it is not in the hash """
+        for key in self._keys.pop(item, ()):
+            bucket = self._buckets[key]
+            bucket.discard(item)
+            if not bucket: del self._buckets[key]
+
+    def move(self, item: T, collider: CollisionRect):
+        """ Updates an item's collider """
+        self.remove(item)
+        self.insert(item, collider)
+
+    def query(self, collider: CollisionRect) -> set[T]:
+        """ Returns all items that may overlap the collider. Exact overlap still has to be checked """
+        found: set[T] = set()
+        for key in self._cells(collider):
+            if key in self._buckets: found |= self._buckets[key]
+        return found
@@ -0,0 +1,32 @@
+from typing import Final, NamedTuple
+""" Player input of a single frame, independent of pyxel so it can be recorded and replayed """
+
+# Key bits. Letters take bits 0-25 in alphabetical order
+LETTERS: Final[range] = range(26)
+KEY_A: Final[int] = ord('a') - ord('a')
+KEY_D: Final[int] = ord('d') - ord('a')
+KEY_R: Final[int] = ord('r') - ord('a')
+KEY_S: Final[int] = ord('s') - ord('a')
+KEY_W: Final[int] = ord('w') - ord('a')
+KEY_SPACE: Final[int] = 26
+KEY_CTRL: Final[int] = 27 # Either control key
+KEYS: Final[int] = 28
+
+class Input(NamedTuple):
+    """ Bitmasks of the keys held down and the keys pressed on a frame, mirroring pyxel's btn and btnp """
+    held: int = 0
+    pressed: int = 0
+
+    def btn(self, key: int) -> bool:
+        """ Returns True if key is held down """
+        return bool(self.held >> key & 1)
+
+    def btnp(self, key: int) -> bool:
+        """ Returns True if key was pressed on this frame """
+        return bool(self.pressed >> key & 1)
+
+def letter(key: int) -> str:
+    """ Returns the lowercase letter of a letter key """
+    return chr(ord('a') + key)
+
+NO_INPUT: Final[Input] = Input()
@@ -1,12 +1,18 @@
-from typing import Iterator
+from array import array
+from typing import Final, Iterator, Sequence
 
 Cell = tuple[int, int]
+SINGLE: Final[range] = range(1) # Ranges are immutable, so every object of the same size shares them
+DOUBLE: Final[range] = range(2)
 
 class GridObject:
     """
     A grid-based object that is used in a Gridmap container. It has a convex rectangular shape. It can also occupy multiple cells.
+    Subclasses declare __slots__ too. Static terrain is kept in a TileLayer instead.
     """
-    def __init__(self, R: range, C: range) -> None:
+    __slots__ = ('_R', '_C')
+
+    def __init__(self, R: range = SINGLE, C: range = SINGLE) -> None:
         self._R, self._C = R, C
 
     @property
@@ -22,6 +28,67 @@ class GridObject:
         """ Return cells relative to object where it exists. These are the intersection of R and C. """
         return ((r, c) for c in self.C for r in self.R)
 
+class TileLayer:
+    """
+    A compact grid of tile codes for terrain that never moves, with hitpoints per cell.
+    Tiles are small integers in flat row-major arrays instead of objects, and code 0 is an empty cell.
+    """
+    def __init__(self, rows: int, cols: int) -> None:
+        self._rows = rows
+        self._cols = cols
+        self.clear()
+
+    @property
+    def codes(self): 
+        """ Tile code of every cell, row-major """
+        return self._codes
+    @property
+    def hitpoints(self): 
+        """ Hitpoints of every cell, row-major """
+        return self._hitpoints
+
+    def clear(self):
+        self._codes = array('B', bytes(self._rows*self._cols))
+        self._hitpoints = array('b', bytes(self._rows*self._cols))
+
+    def code(self, r: int, c: int) -> int:
+        """ Returns the tile code at cell, 0 if empty """
+        return self._codes[r*self._cols + c]
+
+    def hp(self, r: int, c: int) -> int:
+        """ Returns the hitpoints of the tile at cell """
+        return self._hitpoints[r*self._cols + c]
+
+    def place(self, r: int, c: int, code: int, hp: int = 0):
+        """ Puts a tile on a cell """
+        self._codes[r*self._cols + c] = code
+        self._hitpoints[r*self._cols + c] = hp
+
+    def hit(self, r: int, c: int, pts: int = 1) -> int:
+        """ Takes hitpoints from the tile at cell and returns what is left """
+        self._hitpoints[r*self._cols + c] -= pts
+        return self._hitpoints[r*self._cols + c]
+
+    def remove(self, r: int, c: int):
+        """ Empties a cell """
+        self.place(r, c, 0)
+
+    def blocked(self, R: range, C: range) -> bool:
+        """ Returns True if any cell of the subgrid within bounds has a tile """
+        cols, codes = self._cols, self._codes
+        C = range(max(C.start, 0), min(C.stop, cols))
+        return any(any(codes[r*cols + C.start:r*cols + C.stop]) for r in range(max(R.start, 0), min(R.stop, self._rows)))
+
+    def enumerate(self) -> Iterator[tuple[Cell, int]]:
+        """ Enumerates all tiles with their cells, row-major """
+        for i, code in enumerate(self._codes):
+            if code: yield divmod(i, self._cols), code
+
+def first_cell(item: tuple[GridObject, Cell]) -> Cell:
+    """ Returns the top-left cell an object placed at cell covers, to sort objects by """
+    obj, (r, c) = item
+    return r + obj.R.start, c + obj.C.start
+
 class GridMap():
     """
     A standard grid class, ueful for grid-based object manipulation that allows empty cells.
@@ -30,14 +97,16 @@ class GridMap():
     Rows and columns are 0-indexed from top to bottom and left to right, respectively.
     Empty cells are still part of the grid as long as they are within grid boundaries. 
 
-    There can only be at most one grid object in each cell.
+    There can only be at most one grid object or tile in each cell. Tiles live in a TileLayer alongside the object table,
+    or in anything that works like one, such as a chunks.ChunkedTileLayer for huge maps.
     """
-    def __init__(self, rows: int, cols: int, width: int, height: int) -> None:
+    def __init__(self, rows: int, cols: int, width: int, height: int, tiles: TileLayer | None = None) -> None:
         self._rows = rows
         self._cols = cols
         self._width = width
         self._height = height
-        self.clear()
+        self._tiles = tiles if tiles is not None else TileLayer(rows, cols) # A given layer keeps the tiles it has
+        self._clear_objects()
     
     @property
     def rows(self): 
@@ -56,6 +125,10 @@ class GridMap():
         """ Table of object values of grid """
         return self._table
     @property
+    def tiles(self): 
+        """ Terrain tile layer of grid """
+        return self._tiles
+    @property
     def cellwidth(self) -> int: return self.width//self.cols
     @property
     def cellheight(self) -> int: return self.height//self.rows
@@ -65,36 +138,44 @@ class GridMap():
         return self.scan(range(self.rows), range(self.cols))
 
     def __contains__(self, obj: GridObject) -> bool:
-        try:
-            self.find(obj)
-        except ValueError:
-            return False
-        return True
+        return obj in self._index
     
     def enumerate(self) -> Iterator[tuple[Cell, GridObject]]:
-        """ Enumerates all grid objects with their cell locations """
-        enumerated: set[GridObject] = set()
-        for r, row in enumerate(self.table):
-            for c, obj in enumerate(row):
-                if obj is not None and obj not in enumerated: 
-                    enumerated.add(obj)
-                    yield (r - min(obj.R), c - min(obj.C)), obj
+        """ Enumerates all grid objects with their cell locations, in the row-major order of their first cell. Only the objects are looked at, not every cell """
+        for obj, (r, c) in sorted(self._index.items(), key=first_cell):
+            yield (r, c), obj
+
+    def within(self, R: range, C: range) -> list[tuple[Cell, GridObject]]:
+        """ Returns the grid objects that cover any cell of rows R and columns C with their cell locations, in the same order as enumerate. Only the objects are looked at """
+        found = [(obj, (r, c)) for obj, (r, c) in self._index.items() if r + obj.R.stop > R.start and r + obj.R.start < R.stop and c + obj.C.stop > C.start and c + obj.C.start < C.stop]
+        return [(cell, obj) for obj, cell in sorted(found, key=first_cell)]
 
     def clear(self):
-        self._table: list[list[GridObject | None]] = [[None]*self.cols for _ in range(self.rows)]  
+        """ Removes every object and tile """
+        self._clear_objects()
+        self._tiles.clear()
+
+    def _clear_objects(self):
+        empty = (None,)*self.cols # Rows share one empty row until an object is placed on them, so huge maps only hold the rows in use
+        self._table: list[Sequence[GridObject | None]] = [empty]*self.rows
+        self._index: dict[GridObject, Cell] = {} # Reverse lookup of each object's grid coords, kept in sync with the table
     
     def replace(self, r: int, c: int, obj: GridObject): 
         """ Place GridObject on grid """
+        if obj in self._index: raise ValueError('GridObject is already placed on GridMap!')
         for dr, dc in obj.cells:
-            if self._table[r + dr][c + dc] is not None: raise ValueError('Cannot place GridObject on occupied space!')
+            if self._table[r + dr][c + dc] is not None or self._tiles.code(r + dr, c + dc): raise ValueError('Cannot place GridObject on occupied space!')
         for dr, dc in obj.cells:
-            self._table[r + dr][c + dc] = obj
+            if type(row := self._table[r + dr]) is tuple: row = self._table[r + dr] = list(row)
+            row[c + dc] = obj # type: ignore
+        self._index[obj] = r, c
             
     def remove(self, obj: GridObject):
         """ Removes GridObject from grid """
         r, c = self.find(obj)
         for dr, dc in obj.cells:
-            self._table[r + dr][c + dc] = None
+            self._table[r + dr][c + dc] = None # type: ignore # Rows with objects are lists
+        del self._index[obj]
     
     def pop(self, r: int, c: int) -> GridObject:
         """ Removes and returns grid object at cell """
@@ -110,10 +191,14 @@ class GridMap():
     
     def find(self, obj: GridObject) -> Cell:
         """ Finds the grid coords of the GridObject """
-        for r in range(self.rows):
-            for c in range(self.cols):
-                if self.table[r][c] == obj: return r - min(obj.R), c - min(obj.C)
-        raise ValueError('Gridmap does not have GridObject')    
+        try:
+            return self._index[obj]
+        except KeyError:
+            raise ValueError('Gridmap does not have GridObject') from None
+
+    def blocked(self, R: range, C: range, ignore: GridObject | None = None) -> bool:
+        """ Returns True if any cell of the subgrid has a tile or a GridObject other than ignore """
+        return self._tiles.blocked(R, C) or any(obj is not ignore for obj in self.scan(R, C))
 
     def scan(self, R: range, C: range) -> Iterator[GridObject]:
         """ Scans subgrid of cells and returns GridObjects within. Works like a 2D slicer """
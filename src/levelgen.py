@@ -0,0 +1,131 @@
+import random
+import argparse
+from time import perf_counter
+from typing import Final, NamedTuple, Sequence
+""" Seeded generator of random cities in the character format of stage_file, and fast checks that a city is playable """
+
+SIZE: Final[int] = 2 # Cells per side of tanks and the castle, which sit on their top-left cell
+OBJECTS: Final[str] = 'CEP' # Castle, enemy spawns and the player
+NAMES: Final[dict[str, str]] = {'C': 'castle', 'E': 'enemy spawn', 'P': 'player spawn'}
+TILES: Final[str] = 'BRSWLJ' # Tiles that objects can't be placed on. Trees are overhead
+IMPASSABLE: Final[str] = 'SWLJ' # Tiles that tanks can never get through. Bricks can be shot away
+TERRAIN_WEIGHTS: Final[dict[str, int]] = {'B': 50, 'T': 18, 'S': 12, 'W': 12, 'L': 4, 'J': 4} # How often each tile fills a block of the city
+TERRAIN: Final[str] = ''.join(x*n for x, n in TERRAIN_WEIGHTS.items()) # Tiles repeated by weight, so one random number picks both whether and which
+ENEMY_SPACING: Final[int] = 16 # Columns between enemy spawns along the top of wide cities
+ATTEMPTS: Final[int] = 100 # Cities generate() tries before giving up on the arguments
+FREE: Final[bytes] = bytes(ord('0') if chr(n) in IMPASSABLE else ord('1') for n in range(256)) # Translates a row to a binary number of the cells tanks can cross
+
+class Problem(NamedTuple):
+    """ Something that makes a city unplayable, found on a cell """
+    kind: str # 'missing', 'clearance', 'overlap' or 'unreachable'
+    cell: tuple[int, int]
+    detail: str
+
+def footprint(r: int, c: int) -> list[tuple[int, int]]:
+    """ Returns the cells of an object on cell """
+    return [(r + dr, c + dc) for dr in range(SIZE) for dc in range(SIZE)]
+
+def reachable(city: Sequence[str], goal: Sequence[tuple[int, int]]) -> list[int]:
+    """
+    Returns, per row, a bitmask of the cells from which a 2x2 tank can drive to a position overlapping one of the goal cells. Bit c of row r is the tank on cell (r, c).
+    Rows of the city are flooded as whole binary numbers, so each step of the flood costs a few integer operations per row.
+    """
+    rows, cols = len(city), len(city[0])
+    free = [int(row.encode('latin-1').translate(FREE)[::-1], 2) for row in city]
+    mask = (1 << (cols - SIZE + 1)) - 1 # Tanks fit from column 0 up to cols - 2
+    fits = [free[r] & free[r + 1] & (free[r] >> 1) & (free[r + 1] >> 1) & mask for r in range(rows - SIZE + 1)]
+    reach = [0]*len(fits)
+    for r, c in goal:
+        for dr in range(-SIZE + 1, 1):
+            if 0 <= r + dr < len(fits): reach[r + dr] |= fits[r + dr] & sum(1 << (c + dc) for dc in range(-SIZE + 1, 1) if c + dc >= 0) # Tanks whose footprint covers the cell
+    last, changed = len(fits) - 1, bool(reach)
+    while changed: # Sweeps down then up until the flood stops growing
+        changed = False
+        for order in (range(last + 1), range(last, -1, -1)):
+            for r in order:
+                row = reach[r]
+                grown = (row | row << 1 | row >> 1 | (reach[r - 1] if r else 0) | (reach[r + 1] if r < last else 0)) & fits[r]
+                if grown != row: reach[r], changed = grown, True
+    return reach
+
+def check(city: Sequence[str]) -> list[Problem]:
+    """
+    Returns what keeps a city from being played as it is, nothing if it is playable: a missing castle, player or enemy spawn,
+    objects without a 2x2 clearance because they stick out of the city or sit on tiles, objects that overlap each other,
+    and enemy spawns from which tanks can't reach the castle even after shooting away every brick
+    """
+    rows, cols = len(city), len(city[0]) if city else 0
+    problems: list[Problem] = []
+    objects = [((r, c), x) for r, row in enumerate(city) if any(o in row for o in OBJECTS) for c, x in enumerate(row) if x in OBJECTS]
+    for x, name in NAMES.items():
+        if not any(kind == x for _, kind in objects): problems.append(Problem('missing', (0, 0), f"no {name}"))
+    owners: dict[tuple[int, int], tuple[int, int]] = {}
+    for cell, x in objects:
+        for r, c in footprint(*cell):
+            if not (0 <= r < rows and 0 <= c < cols):
+                problems.append(Problem('clearance', cell, f"{NAMES[x]} has no 2x2 clearance, it sticks out of the city at {(r, c)}"))
+                break
+            if city[r][c] in TILES: problems.append(Problem('clearance', cell, f"{NAMES[x]} has no 2x2 clearance, tile {city[r][c]} is at {(r, c)}"))
+            elif (r, c) in owners: problems.append(Problem('overlap', cell, f"{NAMES[x]} overlaps the {NAMES[city[owners[r, c][0]][owners[r, c][1]]]} of {owners[r, c]} at {(r, c)}"))
+            else: owners[r, c] = cell
+    castle = [cell for (r, c), x in objects if x == 'C' for cell in footprint(r, c)]
+    if castle and rows >= SIZE and cols >= SIZE:
+        reach = reachable(city, castle)
+        for (r, c), x in objects:
+            if x == 'E' and r < len(reach) and not reach[r] >> c & 1: problems.append(Problem('unreachable', (r, c), "enemy spawn can't reach the castle"))
+    return problems
+
+def layout(rng: random.Random, rows: int, cols: int, density: float) -> list[str]:
+    """ Lays out one city: the castle walled in bricks at the bottom with the player beside it, enemy spawns along the top and random 2x2 blocks of terrain """
+    city = [['.']*cols for _ in range(rows)]
+    reserved: set[tuple[int, int]] = set() # Cells that terrain blocks stay off
+    castle, player = (rows - SIZE, cols//2 - 1), (rows - SIZE, cols//2 - 4)
+    enemies: list[int] = []
+    for c in sorted({*range(0, cols - SIZE, ENEMY_SPACING), cols//2 - 1, cols - SIZE}):
+        if not enemies or c >= enemies[-1] + SIZE: enemies.append(c) # Spawns stay apart
+    for (r, c), x in ((castle, 'C'), (player, 'P'), *(((0, c), 'E') for c in enemies)):
+        city[r][c] = x
+        reserved.update(footprint(r, c))
+    for r in range(castle[0] - 1, rows):
+        for c in range(castle[1] - 1, castle[1] + SIZE + 1):
+            if (r, c) not in reserved: city[r][c] = 'B'
+            reserved.add((r, c))
+    taken = {(r - r % SIZE, c - c % SIZE) for r, c in reserved} # Blocks with a reserved cell
+    for r in range(0, rows - 1, SIZE):
+        for c in range(0, cols - 1, SIZE):
+            if (roll := rng.random()) >= density or (r, c) in taken: continue
+            x = TERRAIN[int(roll/density*len(TERRAIN))]
+            if x in 'LJ': # Mirrors stand alone
+                dr, dc = rng.randrange(SIZE), rng.randrange(SIZE)
+                city[r + dr][c + dc] = x
+            else:
+                for cr, cc in footprint(r, c): city[cr][cc] = x
+    return [''.join(row) for row in city]
+
+def generate(seed: int, rows: int = 32, cols: int = 32, density: float = 0.35) -> list[str]:
+    """
+    Returns a playable random city, as rows of characters like stage_file.Level.city. Equal arguments always give the same city.
+    Cities that fail check() are laid out again, and ValueError is raised if none of ATTEMPTS passes
+    """
+    if rows < 4*SIZE or cols < 4*SIZE: raise ValueError(f"Cities must be at least {4*SIZE}x{4*SIZE} cells")
+    rng = random.Random(seed)
+    for _ in range(ATTEMPTS):
+        city = layout(rng, rows, cols, density)
+        if not check(city): return city
+    raise ValueError(f"No playable city in {ATTEMPTS} attempts, try a lower density")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generates random cities and reports how fast they are generated and checked")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first city, the others follow (default: 0)")
+    parser.add_argument("--count", type=int, default=1000, help="number of cities (default: 1000)")
+    parser.add_argument("--size", type=int, nargs=2, default=(32, 32), metavar=("ROWS", "COLS"), help="cells of every city (default: 32 32)")
+    parser.add_argument("--density", type=float, default=0.35, help="chance of terrain on every 2x2 block (default: 0.35)")
+    parser.add_argument("--print", action="store_true", help="print every city")
+    args = parser.parse_args()
+    rows, cols = args.size
+    start = perf_counter()
+    for seed in range(args.seed, args.seed + args.count):
+        city = generate(seed, rows, cols, args.density)
+        if args.print: print(f"seed {seed}", *city, sep="\n", end="\n\n")
+    seconds = perf_counter() - start
+    print(f"{args.count} playable {rows}x{cols} cities in {seconds:.3f}s, {args.count/seconds:.0f} cities/s")
@@ -0,0 +1,66 @@
+import os
+import sys
+import argparse
+import levelgen
+import stage_file
+from time import perf_counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Sequence
+""" Checks the levels of a resource file for what would break them at runtime. Exits with status 1 if any level has a problem, so it can gate a release """
+
+def duplicates(tilemap: stage_file.Tilemap, rows: int, cols: int) -> list[levelgen.Problem]:
+    """
+    Returns the player sprites that parse() drops, as it keeps only the first player tile. Sprites are found by their tiles other than the top-left one,
+    since that one is also the empty tile
+    """
+    origins: set[tuple[int, int]] = set()
+    first: tuple[int, int] | None = None
+    for r in range(rows):
+        for c in range(cols):
+            tile = tilemap.pget(c, r)
+            if tile in stage_file.WorldObjects.PLAYER:
+                if first is None: first = r, c
+                if tile != stage_file.EMPTY: origins.add((r - tile[1], c - tile[0]))
+    return [levelgen.Problem('duplicate', origin, f"second player is dropped, the player starts at {first}") for origin in sorted(origins) if origin != first]
+
+def clearance(city: Sequence[str], cells: Sequence[tuple[int, int]]) -> list[levelgen.Problem]:
+    """ Returns the power-up spawns where the player can't sit to pick a power-up up: off the map or on a tile tanks can't get through """
+    rows, cols = len(city), len(city[0])
+    return [levelgen.Problem('clearance', (r, c), "power-up spawn has no 2x2 clearance for the player") for r, c in cells
+            if not all(0 <= rr < rows and 0 <= cc < cols and city[rr][cc] not in levelgen.IMPASSABLE for rr, cc in levelgen.footprint(r, c))]
+
+def lint_level(level: stage_file.Level) -> list[levelgen.Problem]:
+    """ Returns the problems of a parsed level. Spawns of the player, enemies and power-ups all need a 2x2 clearance """
+    return levelgen.check(level.city) + clearance(level.city, level.powerups_spawnpoint)
+
+def lint_tilemap(tilemap: stage_file.Tilemap) -> list[levelgen.Problem]:
+    """ Returns the problems of a level as it is in its tilemap """
+    rows, cols = stage_file.measure(tilemap)
+    return duplicates(tilemap, rows, cols) + lint_level(stage_file.parse(tilemap, rows, cols))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reports spawns without a 2x2 clearance, overlapping objects, duplicate players and enemy spawns that can't reach the castle in every level")
+    parser.add_argument("resource", nargs="?", default=stage_file.RESOURCE_FILE, help="pyxel resource file (default: my_resource.pyxres)")
+    parser.add_argument("--pack", action="store_true", help="check the compiled levels of the resource file instead of its tilemaps")
+    parser.add_argument("--levels", type=int, nargs="+", default=range(1, stage_file.MapLoader.LEVELS + 1), metavar="N", help="levels to check (default: the playable ones)")
+    parser.add_argument("--jobs", type=int, default=0, help="levels checked at once in separate processes, 1 to check them in this one (default: 0, one per CPU)")
+    args = parser.parse_args()
+    start = perf_counter()
+    levels = list(args.levels)
+    check: Callable[[Any], list[levelgen.Problem]] # Checks a parsed level or a tilemap, whichever the levels are read as
+    if args.pack: # Second players were already dropped when the pack was built
+        if (pack := stage_file.read_pack(args.resource)) is None: parser.error(f"{stage_file.pack_path(args.resource)} is missing or older than {args.resource}, run python stage_file.py")
+        check, items = lint_level, [pack[level] for level in levels]
+    else:
+        tilemaps = stage_file.ResourceFile(args.resource) # Read once here, as reading the resource file takes longer than checking its levels
+        check, items = lint_tilemap, [tilemaps[level] for level in levels]
+    jobs = min(args.jobs or os.cpu_count() or 1, len(levels))
+    if jobs > 1:
+        with ProcessPoolExecutor(jobs) as executor: results = list(executor.map(check, items))
+    else:
+        results = list(map(check, items))
+    for level, problems in zip(levels, results):
+        for problem in problems: print(f"level {level}: {problem.kind} at {problem.cell}: {problem.detail}")
+    count = sum(map(len, results))
+    print(f"{count} problems in {len(levels)} levels, checked in {1000*(perf_counter() - start):.1f} ms")
+    sys.exit(1 if count else 0)
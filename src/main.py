@@ -1,47 +1,77 @@
-import pyxel as px  # Since this is the main file, pyxel should only be imported here?
 import grid
+import collision
 import random
+import hashlib
 import sounds
+import backends
+import controls
+import replay
+import pathfinding
+import chunks
+import profiler
+import argparse
+import sys
+import time
+from array import array
 from stage_file import MapLoader
-from typing import Literal, Iterator, Final, TypeAlias
-from dataclasses import dataclass, astuple
-from functools import partial
-from threading import Timer
+from scheduler import Scheduler
+from pool import Pool
+from typing import TYPE_CHECKING, Callable, Hashable, Literal, Iterator, Final, NamedTuple, Sequence, TypeAlias
+from functools import cache, partial
+from collision import CollisionRect
+if TYPE_CHECKING: import pyxel as px # The front end imports pyxel in the methods that use it, so the simulation runs headless without pyxel installed
 
 Position: TypeAlias = tuple[int, int]
-CollisionRect: TypeAlias = tuple[range, range]
 Directions: TypeAlias = Literal['N', 'E', 'W', 'S']
 
 # Settings
 DISPLAY_WIDTH: Final[int] = 256
 DISPLAY_HEIGHT: Final[int] = 256
-FPS: Final[int] = 60
-ROWS: Final[int] = 32
+FPS: Final[int] = 60 # Rendered frames per second
+TICK_RATE: Final[int] = 60 # Simulation updates per second. Every speed and timer of the game counts in these ticks, whatever the frame rate
+ROWS: Final[int] = 32 # Cells that fit on the screen. Maps take their size from the level and can be larger
 COLS: Final[int] = 32 
+CELL_SIZE: Final[int] = DISPLAY_WIDTH//COLS # px
+CHUNKED_MAP_CELLS: Final[int] = 128*128 # Maps with more cells keep their terrain in chunks, and only hold the ones near tanks in memory
+CHUNK_RADIUS: Final[int] = 1 # Chunks around the player and every enemy that stay in memory
+CHUNK_CAPACITY: Final[int] = 64 # Most chunks of a layer held in memory at once
+BLOCK_MARGIN: Final[int] = 1 # Blocks around the view whose baked terrain is kept, so scrolling back doesn't bake them again
 PLAYER_LIVES: Final[int] = 2
 PLAYER_MOVEMENT_SPD: Final[int] = 36 # px/s
 POWERUP_SPAWN_TIMER_SEC: Final[int] = 5
+LEVEL_TIMERS: Final[str] = 'level' # Scheduler group of the timers that end with the level, like respawns and the game over of a destroyed castle. Power-ups outlast it
+TURBO: Final[int] = 8 # Ticks per tick due while turbo is on, toggled with TAB
+SEED: Final[int | None] = None # Fixes the seed of every game for deterministic runs, a random seed is picked when None
+PROFILE_WINDOW: Final[int] = 120 # Frames the profiler overlay takes percentiles over, toggled with F3
 
 # Bullet settings
 DEFAULT_BULLET_SPD: Final[int] = 240 # px/s
 BULLET_MOVEMENT_LIMIT: Final[int] = 256 # px
+BULLET_BROADPHASE_CELL: Final[int] = 16 # px, cell size of the bullet-to-bullet spatial hash
+POOL_CAPACITY: Final[int] = 256 # Spent bullets and explosions kept for reuse per kind, 0 disables pooling
 
 # Enemy AI settings
 ENEMY_REDIRECT_CHANCE: Final[float] = 0.1738 # p
 ENEMY_MOVEMENT_CHANCE: Final[float] = 0.525600 # q
 ENEMY_SHOOT_CHANCE: Final[float] = 0.069420 # r
+SMART_ENEMIES: Final[bool] = False # Enemies head for the castle along a distance field instead of picking random directions
+SMART_ENEMY_BRICK_COST: Final[int] = 4 # Extra moves a smart enemy would rather make than shoot its way through a brick
+ENEMY_MOVE_THRESHOLD: Final[int] = int(ENEMY_MOVEMENT_CHANCE*ENEMY_REDIRECT_CHANCE*2**32) # Enemies move when a 32-bit roll is below this (q*p)
+ENEMY_SHOOT_THRESHOLD: Final[int] = int(ENEMY_SHOOT_CHANCE*2**32) # and shoot when another is below this (r)
 
 # Cheat Code
 UNDYING_CHEAT_CODE = "failures"
 HEALTH_CHEAT_CODE = "hesoyam"
 MAGIC_CHEAT_CODE = "fries"
 
-@dataclass
-class Texture:
+FACINGS: Final[dict[Directions, int]] = {'N': 0, 'W': 1, 'S': 2, 'E': 3} # Order of directional sprites in the image banks, 16px apart
+
+class Texture(NamedTuple):
     """
     A texture class component useful for drawing sprites in a pyxel game (https://github.com/kitao/pyxel). 
     Property values are determined through pyxel's resource editor.
     Intended to be unpacked as arguments of px.blt() -> refer to pyxel documentation
+    Textures are immutable tuples, so unpacking them costs nothing and they can be shared. Use _replace() for a modified copy
     """
     img_bnk: int
     x: int
@@ -50,11 +80,32 @@ class Texture:
     h: int = 8
     colkey: int = 0
 
-    def __iter__(self):
-        return iter(astuple(self))  
-    
     def copy(self):
-        return Texture(*self)
+        return self
+
+    def oriented(self) -> tuple['Texture', 'Texture', 'Texture', 'Texture']:
+        """ Returns the directional variants of the texture, indexed by FACINGS. They are computed once per texture """
+        if self not in _oriented: _oriented[self] = (self._replace(x = 0), self._replace(x = 16), self._replace(x = 32), self._replace(x = 48))
+        return _oriented[self]
+
+_oriented: dict[Texture, tuple[Texture, Texture, Texture, Texture]] = {}
+
+DIRECTIONS: Final[tuple[Directions, ...]] = ('N', 'W', 'S', 'E')
+
+def enemy_rolls(rng: random.Random, count: int) -> Iterator[tuple[Directions | None, bool]]:
+    """
+    Rolls the AI decisions of count enemies in one batch of random bits: the direction each moves to (None if it stays) and whether it would shoot.
+    Every enemy gets two 32-bit rolls. It moves with chance q*p, in a direction picked by where its roll falls below the threshold, and shoots with chance r
+    """
+    rolls = array('I', rng.randbytes(8*count))
+    if sys.byteorder == 'big': rolls.byteswap() # Same decisions on every platform
+    moves, shots = ENEMY_MOVE_THRESHOLD, ENEMY_SHOOT_THRESHOLD
+    return ((DIRECTIONS[4*move//moves] if move < moves else None, shoot < shots) for move, shoot in zip(rolls[::2], rolls[1::2]))
+
+@cache
+def tile_texture(x: int, y: int) -> Texture:
+    """ Returns the shared 8x8 texture at (x, y) of image bank 1, so tiles with the same look share one instance """
+    return Texture(1, x, y)
     
 class Animation:
     """ 
@@ -105,21 +156,34 @@ class Animation:
         self._paused = True
         return self
 
+    def rewind(self):
+        """ Goes back to the first frame """
+        self._frame = 0
+        return self
+
 class Explosion:
     def __init__(self, texture: Texture) -> None:
-        self._animation = Animation(30) # 30 frames (0.5s)
+        self._origin = texture
+        self._animation = Animation(TICK_RATE//2) # 0.5s
         for n in range(4):
-            texture.x = n * 16
-            self._animation.add(texture.copy(), 30*n//4)
+            self._animation.add(texture._replace(x = n * 16), TICK_RATE//2*n//4)
         self._animation.play()
 
     @property
     def texture(self): return self._animation.texture
     @property
     def animation(self): return self._animation
+    @property
+    def origin(self): 
+        """ Returns the texture the explosion was made from """
+        return self._origin
     
     def update(self):
         self._animation.update()
+
+    def reset(self):
+        """ Plays the explosion again from the start, for reuse """
+        self._animation.rewind().play()
          
 class Bullet:
     def __init__(self,
@@ -131,12 +195,13 @@ class Bullet:
                  ) -> None:
         self._collider = collider # Relative to bullet (X, Y)
         self._texture: Texture
-        self._explosion: Explosion
+        self._explosion_texture: Texture
         self._facing = facing
         self._hp = hp
+        self._dmg = hp
         self._speed = speed
         self.steps = 0
-        self.last_mirror: Mirror | None = None # last mirror object this bullet reflected from
+        self.last_mirror: grid.Cell | None = None # cell of the last mirror this bullet reflected from
 
     @property
     def collider(self): 
@@ -145,11 +210,11 @@ class Bullet:
     @property
     def texture(self):
         """ Returns oriented texture """
-        temp = self._texture
-        temp.x = 'NWSE'.index(self.facing)*16
-        return temp
+        return self._texture.oriented()[FACINGS[self.facing]]
     @property
-    def explosion(self): return self._explosion
+    def explosion_texture(self): 
+        """ Returns the texture that explosions of this bullet start from, which also tells them apart in a pool """
+        return self._explosion_texture
     @property
     def facing(self): return self._facing # Also keeps track of movement. No need for dx, dy
     @facing.setter
@@ -168,56 +233,65 @@ class Bullet:
         """ Reduces hitpoints by specified number. Default dmg value is 1 """
         self._hp -= pts
 
+    def reset(self, dir: Directions):
+        """ Makes the bullet as good as new, flying towards dir, for reuse """
+        self.facing = dir
+        self._hp = self._dmg
+        self.steps = 0
+
     @classmethod
-    def sound(cls, type: str): 
+    def sound(cls, type: str, audio: sounds.Audio = sounds): 
         """ Class interface for sounds based on type """
         pass
 
 class Arrow(Bullet):
-    def __init__(self, *, dir: Directions, hostile: bool = False):
+    def __init__(self, *, dir: Directions, hostile: bool = False, speed: int = DEFAULT_BULLET_SPD):
         super().__init__((range(5,10), range(5,10)),
-                         facing = dir)
+                         facing = dir,
+                         speed = speed)
         self._texture = Texture(2,0,64,16,16) if hostile else Texture(2,0,80,16,16)
-        self._explosion = Explosion(Texture(1,0,64,16,16)) if hostile else Explosion(Texture(1,0,80,16,16))
+        self._explosion_texture = Texture(1,0,64,16,16) if hostile else Texture(1,0,80,16,16)
     
     @classmethod
-    def sound(cls, type: str):
+    def sound(cls, type: str, audio: sounds.Audio = sounds):
         match type:
-            case 'shot': sounds.arrow_shoot()
-            case 'explode': sounds.arrow_collision()
+            case 'shot': audio.arrow_shoot()
+            case 'explode': audio.arrow_collision()
             case _: pass
 
 class MagicArrow(Bullet):
-    def __init__(self, *, dir: Directions, hostile: bool = False, dmg: int = 3):
+    def __init__(self, *, dir: Directions, hostile: bool = False, dmg: int = 3, speed: int = 300):
         super().__init__((range(4,12), range(2,13)),
                          facing = dir,
                          hp = dmg,
-                         speed = 300)
-        self._animation = Animation(30, True)
+                         speed = speed)
+        self._animation = Animation(TICK_RATE//2, True)
         if hostile:
             self._animation.add(Texture(2,0,0,16,16))
-            self._animation.add(Texture(2,0,16,16,16), 15)
-            self._explosion = Explosion(Texture(1,0,112,16,16))
+            self._animation.add(Texture(2,0,16,16,16), TICK_RATE//4)
+            self._explosion_texture = Texture(1,0,112,16,16)
         else:
             self._animation.add(Texture(2,0,32,16,16))
-            self._animation.add(Texture(2,0,48,16,16), 15)
-            self._explosion = Explosion(Texture(1,0,128,16,16))
+            self._animation.add(Texture(2,0,48,16,16), TICK_RATE//4)
+            self._explosion_texture = Texture(1,0,128,16,16)
         self._animation.play()
 
     @property
     def texture(self):
-        temp = self._animation.texture
-        temp.x = 'NWSE'.index(self.facing)*16
-        return temp
+        return self._animation.texture.oriented()[FACINGS[self.facing]]
 
     def update(self):
         self._animation.update()
 
+    def reset(self, dir: Directions):
+        super().reset(dir)
+        self._animation.rewind().play()
+
     @classmethod
-    def sound(cls, type: str): 
+    def sound(cls, type: str, audio: sounds.Audio = sounds): 
         match type:
-            case 'shot': sounds.magic_arrow_shoot()
-            case 'explode': sounds.magic_arrow_collision()
+            case 'shot': audio.magic_arrow_shoot()
+            case 'explode': audio.magic_arrow_collision()
             case _: pass
     
 class PowerUp:
@@ -240,13 +314,15 @@ class Evolved(PowerUp): # No texture yet, prolly not necessary
         super().__init__(Texture(1, 16, 96, 16, 16)) 
 
 class Tank(grid.GridObject):
+    __slots__ = ('_texture', '_bullet', '_explosion_texture', '_shot', '_invulnerable', '_powerups', '_facing')
+
     def __init__(self, 
                  texture: Texture,
                  bullet: partial[Bullet]) -> None:
-        super().__init__(range(2), range(2))
+        super().__init__(grid.DOUBLE, grid.DOUBLE)
         self._texture = texture
         self._bullet = bullet
-        self._explosion = partial(Explosion, Texture(1,0,32,16,16))
+        self._explosion_texture = Texture(1,0,32,16,16)
         self._shot = False
         self._invulnerable = False
         self._powerups: list[PowerUp] = []
@@ -255,14 +331,14 @@ class Tank(grid.GridObject):
     @property
     def texture(self): return self._texture
     @property
-    def explosion(self): return self._explosion()
+    def explosion_texture(self): return self._explosion_texture
     @property
     def facing(self): return self._facing
     @facing.setter
     def facing(self, dir: Directions):
         """ Reorients Tank and updates texture """
         self._facing = dir
-        self._texture.x = "NWSE".index(dir)*16
+        self._texture = self._texture.oriented()[FACINGS[dir]]
     @property
     def shot(self): 
         """ Returns True if tank shot a bullet """
@@ -270,8 +346,7 @@ class Tank(grid.GridObject):
     @shot.setter
     def shot(self, value: bool):
         if self._shot ^ value:
-            if value: self._texture.y += 16
-            else: self._texture.y -= 16
+            self._texture = self._texture._replace(y = self._texture.y + (16 if value else -16))
         self._shot = value
     @property
     def bullet(self) -> Bullet:  
@@ -282,12 +357,16 @@ class Tank(grid.GridObject):
         """ Changes the tank's bullet model """
         self._bullet = value
     @property
+    def bullet_kind(self): 
+        """ Returns a hashable description of the tank's bullet model, so bullets of the same model can be pooled together """
+        return self._bullet.func, self._bullet.args, tuple(sorted(self._bullet.keywords.items()))
+    @property
     def invulnerable(self): return self._invulnerable
     @property
     def powerups(self): return self._powerups
 
-    def powerup(self, power: PowerUp, duration_sec: int = 10):
-        """ Gives the tank a timed power """
+    def powerup(self, power: PowerUp):
+        """ Gives the tank a power until powerdown is called. Evolved powers are given along with their boosts by GameState.powerup """
         self._powerups.append(power)
         if isinstance(power, AttackBoost): # Stronger Attacks + Counters other MagicArrows for 10 secs
             self._bullet = partial(MagicArrow, dmg = 3)
@@ -295,12 +374,6 @@ class Tank(grid.GridObject):
         if isinstance(power, DefenseBoost): # Invulnerable for 10 secs
             self._texture = Texture(0, self._texture.x, 32, 16, 16)
             self._invulnerable = True
-
-        if isinstance(power, Evolved): # Both Boosts
-            self.powerup(AttackBoost(), duration_sec)
-            self.powerup(DefenseBoost(), duration_sec)
-        sounds.powered_up()
-        Timer(duration_sec, partial(self.powerdown, power)).start()
  
     def powerdown(self, power: PowerUp):
         """ Removes the tank's power """
@@ -311,122 +384,118 @@ class Tank(grid.GridObject):
 
         if isinstance(power, DefenseBoost) and not any(map(lambda pow: isinstance(pow, DefenseBoost), self._powerups)):
             self._invulnerable = False
-            self._texture.y = 16
+            self._texture = self._texture._replace(y = 16)
         
 class FriendTank(Tank):
+    __slots__ = ()
+
     def __init__(self) -> None:
         super().__init__(Texture(0,0,0,16,16), partial(Arrow))
         self._facing = 'N'
 
 class EnemyTank(Tank):
+    __slots__ = ()
+
     def __init__(self) -> None:
         super().__init__(Texture(0,0,64,16,16), partial(Arrow, hostile = True))
         self._facing = 'S'
 
 class MagicTank(Tank):
+    __slots__ = ()
+
     def __init__(self) -> None:
         super().__init__(Texture(0,0,96,16,16), partial(MagicArrow, hostile = True))
         self._facing = 'S'
 
-class Brick(grid.GridObject):
-    def __init__(self, r: int, c: int, hp: int = 3) -> None:
-        super().__init__(range(1), range(1))
-        self._texture = Texture(1, 0, 48)
-        self._texture.x += 8*(c%2)+(16*(3-hp))
-        self._texture.y += 8*(r%2)
-        self._hp = hp
-
-    @property
-    def hp(self): 
-        """ Returns the current hitpoints of brick """
-        return self._hp
-    @property
-    def texture(self): return self._texture
-
-    def hit(self, pts: int = 1):
-        self._hp -= pts
-        self._texture.x += 16*pts
-    
-class Water(grid.GridObject):
-    def __init__(self, r: int, c: int) -> None:
-        super().__init__(range(1), range(1))
-        self._texture = Texture(1, 16, 0)
-        self._texture.x += 8*(c%2)
-        self._texture.y += 8*(r%2)
-   
-    @property
-    def texture(self): return self._texture
-
-class Stone(grid.GridObject):
-    def __init__(self, r: int, c: int) -> None:
-        super().__init__(range(1), range(1))
-        self._texture = Texture(1, 32, 16)
-        self._texture.x += 8*(c%2)
-        self._texture.y += 8*(r%2)
-
-    @property
-    def texture(self): return self._texture
-
-class Tree(grid.GridObject):
-    def __init__(self, r: int, c: int) -> None:
-        super().__init__(range(1), range(1))
-        self._texture = Texture(1, 48, 0)
-        self._texture.x += 8*(c%2)
-        self._texture.y += 8*(r%2)
-
-    @property
-    def texture(self): return self._texture
-
-class Mirror(grid.GridObject):
-    def __init__(self, type: bool = False) -> None:
-        self._type = type 
-        super().__init__(range(1), range(1))
-        self._texture = Texture(1, 8, 16) if type else Texture(1, 16, 16)
-    
-    @property 
-    def type(self): 
-        """ Returns true if slope of mirror is postive (NE to SW), false if negative """
-        return self._type
-    @property
-    def texture(self): return self._texture
-
-    def reflect(self, bullet: Bullet):
-        """ Reflects bullet based on orientation (type) """
-        if self.type:
-            match bullet.facing:
-                case 'N': bullet.facing = 'E'
-                case 'W': bullet.facing = 'S'
-                case 'S': bullet.facing = 'W'
-                case 'E': bullet.facing = 'N'
-        else:
-            match bullet.facing:
-                case 'N': bullet.facing = 'W'
-                case 'W': bullet.facing = 'N'
-                case 'S': bullet.facing = 'E'
-                case 'E': bullet.facing = 'S'
-        bullet.last_mirror = self
+# Terrain tile codes, kept in the tile layers of GridMaps instead of as objects. 0 is an empty cell
+BRICK: Final[int] = 1
+WATER: Final[int] = 2
+STONE: Final[int] = 3
+MIRROR: Final[int] = 4 # Negative slope (NW to SE)
+MIRROR_POSITIVE: Final[int] = 5 # Positive slope (NE to SW)
+TREE: Final[int] = 6
+BRICK_HP: Final[int] = 3
+MIRRORS: Final = (MIRROR, MIRROR_POSITIVE)
+TILE_NAMES: Final[dict[int, str]] = {BRICK: 'Brick', WATER: 'Water', STONE: 'Stone', MIRROR: 'Mirror', MIRROR_POSITIVE: 'Mirror', TREE: 'Tree'}
+TERRAIN: Final[dict[str, tuple[int, int]]] = {'B': (BRICK, BRICK_HP), 'R': (BRICK, 1), 'W': (WATER, 0), 'S': (STONE, 0), 'L': (MIRROR, 0), 'J': (MIRROR_POSITIVE, 0)} # City character to tile code and hitpoints
+CANOPY: Final[dict[str, tuple[int, int]]] = {'T': (TREE, 0)} # Tiles of the trees, which are drawn over tanks
+
+def city_tiles(city: Sequence[Sequence[str]], kinds: dict[str, tuple[int, int]], R: range, C: range) -> Iterator[tuple[grid.Cell, int, int]]:
+    """ Yields the cell, code and hitpoints of every tile of a kind in kinds within rows R and columns C of a city. A chunks.Source once the first two are given """
+    for r in R:
+        row = city[r]
+        for c in C:
+            if (tile := kinds.get(row[c])) is not None: yield (r, c), *tile
+
+def terrain_texture(code: int, r: int, c: int, hp: int = BRICK_HP) -> Texture:
+    """ Returns the texture of a tile on cell (r, c). Bricks crack as they lose hitpoints """
+    if code == BRICK: return tile_texture(8*(c%2)+(16*(BRICK_HP-hp)), 48 + 8*(r%2))
+    if code == WATER: return tile_texture(16 + 8*(c%2), 8*(r%2))
+    if code == STONE: return tile_texture(32 + 8*(c%2), 16 + 8*(r%2))
+    if code == MIRROR: return tile_texture(16, 16)
+    if code == MIRROR_POSITIVE: return tile_texture(8, 16)
+    if code == TREE: return tile_texture(48 + 8*(c%2), 8*(r%2))
+    raise ValueError(f'Unknown tile code {code}')
+
+def reflect(bullet: Bullet, positive: bool, cell: grid.Cell):
+    """ Reflects bullet off the mirror on cell, based on the mirror's slope """
+    if positive:
+        match bullet.facing:
+            case 'N': bullet.facing = 'E'
+            case 'W': bullet.facing = 'S'
+            case 'S': bullet.facing = 'W'
+            case 'E': bullet.facing = 'N'
+    else:
+        match bullet.facing:
+            case 'N': bullet.facing = 'W'
+            case 'W': bullet.facing = 'N'
+            case 'S': bullet.facing = 'E'
+            case 'E': bullet.facing = 'S'
+    bullet.last_mirror = cell
 
 class Castle(grid.GridObject):
     """ Castle object, instant gameover when destroyed """
+    __slots__ = ('_texture',)
+    TEXTURE: Final[Texture] = Texture(1, 48, 16, 16, 16)
+
     def __init__(self) -> None:
-        super().__init__(range(2), range(2))
-        self._texture = Texture(1, 48, 16, 16, 16)
+        super().__init__(grid.DOUBLE, grid.DOUBLE)
+        self._texture = self.TEXTURE
     
     @property
     def texture(self): return self._texture
 
 class GameState:
-    def __init__(self, level: int = 0) -> None:
+    """
+    The game simulation. Sounds and levels go through an injected backend, so it can run headless with backends.headless().
+    Defaults to the pyxel backend.
+    """
+    def __init__(self, level: int = 0, backend: backends.Backend | None = None, seed: int | None = SEED, smart_enemies: bool = SMART_ENEMIES, profile: profiler.Profiler | None = None) -> None:
+        self._backend = backend if backend is not None else backends.pyxel()
+        self._audio = self._backend.audio
+        self._profiler = profile if profile is not None else profiler.Profiler(enabled = False) # Times the phases of update, never touches the game
+        self._seed = seed if seed is not None else random.randrange(2**32)
+        self._rng = random.Random(self._seed) # Every random decision goes through this, so a seed replays the same game
+        self._smart_enemies = smart_enemies
+        self._field: pathfinding.DistanceField | None = None # Distances to the castle, only kept for smart enemies
+        self._chunked: bool = False # Whether the terrain of the current city is kept in chunks
         self._level = level
         self._lives: int = PLAYER_LIVES
         self._wave: int = 1
         self._player: Tank = FriendTank()
-        self._gridmap = grid.GridMap(ROWS, COLS, DISPLAY_WIDTH, DISPLAY_HEIGHT)
-        self._trees = grid.GridMap(ROWS, COLS, DISPLAY_WIDTH, DISPLAY_HEIGHT)
-        self._enemies: set[Tank] = set()
+        self._gridmap = grid.GridMap(ROWS, COLS, COLS*CELL_SIZE, ROWS*CELL_SIZE) # Resized to fit each level as it is loaded
+        self._trees = grid.GridMap(ROWS, COLS, COLS*CELL_SIZE, ROWS*CELL_SIZE)
+        self._enemies: dict[Tank, None] = {} # Ordered set, so enemies always act in the same order
         self._bullets: dict[Bullet, tuple[Position, Tank]] = {}
+        self._previous: dict[Bullet, Position] = {} # Where bullets were before the last update, for drawing in between ticks
         self._explosions: dict[Explosion, Position] = {} 
+        self._bullet_pool: Pool[Hashable, Bullet] = Pool(POOL_CAPACITY) # Spent bullets and explosions are reused instead of reallocated
+        self._bullet_kinds: dict[Bullet, Hashable] = {} # Pool key of every bullet in flight
+        self._explosion_pool: Pool[Texture, Explosion] = Pool(POOL_CAPACITY)
         self._powerups: dict[PowerUp, Position] = {}
+        self._scheduler = Scheduler() # Timed effects, ticked once per update
+        self._terrain_version: int = 0 # Changes whenever a new city is loaded
+        self._dirty_cells: list[grid.Cell] = [] # Cells whose terrain changed since the renderer last looked
         self.load()
         self._player_states: dict[int, tuple[Tank, int]] = {level: (self._player, self._lives)} # Stores player state for each level
         self._just_powered_up: bool = False
@@ -453,7 +522,7 @@ class GameState:
     def gridmap(self): return self._gridmap
     @property
     def enemies(self): 
-        """ Returns the set of all enemies """
+        """ Returns all enemies in spawn order, as the keys of a dictionary """
         return self._enemies
     @property
     def bullets(self): 
@@ -468,37 +537,92 @@ class GameState:
         """ Dictionary that tracks powerups' position """
         return self._powerups
     @property
+    def pools(self): 
+        """ Returns the bullet and explosion pools """
+        return self._bullet_pool, self._explosion_pool
+    @property
     def is_gameover(self): return self._lives == 0        
+    @property
+    def backend(self): return self._backend
+    @property
+    def frame(self): 
+        """ Returns the number of updates so far """
+        return self._scheduler.frame
+    @property
+    def scheduler(self): return self._scheduler
+    @property
+    def terrain_version(self): 
+        """ Returns a number that changes whenever a new city is loaded, so renderers know to redraw all terrain """
+        return self._terrain_version
+    @property
+    def seed(self): 
+        """ Returns the seed of this game's random decisions """
+        return self._seed
+    @property
+    def smart_enemies(self): 
+        """ Returns True if enemies head for the castle instead of picking random directions """
+        return self._smart_enemies
+    @property
+    def chunked(self): 
+        """ Returns True if the terrain of the current city is kept in chunks, for cities of more than CHUNKED_MAP_CELLS cells """
+        return self._chunked
+    @property
+    def profiler(self): return self._profiler
+    @property
+    def field(self): 
+        """ Returns the distance field that leads smart enemies to the castle, None if enemies are not smart """
+        return self._field
 
     def load(self):
         """ Loads the corresponding city per current level """
-        self._city = MapLoader(self._level).load()
+        self.close() # Chunks of the previous city are never read again
+        self._map = MapLoader(self._level, self._backend.tilemaps, self._audio) # Levels are parsed once and cached by stage_file
+        self._city = self._map.load()
+        rows, cols = len(self._city), len(self._city[0])
+        self._chunked = rows*cols > CHUNKED_MAP_CELLS
+        if self._chunked: # Terrain is read from the city a chunk at a time, as tanks and bullets get near it
+            self._gridmap = grid.GridMap(rows, cols, cols*CELL_SIZE, rows*CELL_SIZE, chunks.ChunkedTileLayer(rows, cols, partial(city_tiles, self._city, TERRAIN), capacity = CHUNK_CAPACITY)) # type: ignore
+            self._trees = grid.GridMap(rows, cols, cols*CELL_SIZE, rows*CELL_SIZE, chunks.ChunkedTileLayer(rows, cols, partial(city_tiles, self._city, CANOPY), capacity = CHUNK_CAPACITY)) # type: ignore
+        elif (rows, cols) != (self._gridmap.rows, self._gridmap.cols) or isinstance(self._gridmap.tiles, chunks.ChunkedTileLayer):
+            self._gridmap = grid.GridMap(rows, cols, cols*CELL_SIZE, rows*CELL_SIZE)
+            self._trees = grid.GridMap(rows, cols, cols*CELL_SIZE, rows*CELL_SIZE)
+        self._terrain_version += 1
+        self._dirty_cells.clear()
+        tiles, canopy = self._gridmap.tiles, self._trees.tiles
+        castle: list[grid.Cell] = []
         for i, row in enumerate(self._city):
+            if self._chunked and 'C' not in row and 'E' not in row: continue
             for j, x in enumerate(row):
                 match x:
-                    case 'B': self._gridmap.replace(i, j, Brick(i, j))
-                    case 'T': self._trees.replace(i, j, Tree(i, j))
-                    case 'W': self._gridmap.replace(i, j, Water(i, j))
-                    case 'S': self._gridmap.replace(i, j, Stone(i, j))
-                    case 'L': self._gridmap.replace(i, j, Mirror())
-                    case 'J': self._gridmap.replace(i, j, Mirror(True))
-                    case 'R': self._gridmap.replace(i, j, Brick(i, j, hp = 1))
-                    case 'C': self._gridmap.replace(i, j, Castle())
+                    case 'C': 
+                        self._gridmap.replace(i, j, obj := Castle())
+                        castle += [(i + dr, j + dc) for dr, dc in obj.cells]
                     case 'E':
                         enemy = EnemyTank()
-                        self._enemies.add(enemy)
+                        self._enemies[enemy] = None
                         self._gridmap.replace(i, j, enemy)
+                    case _ if self._chunked: pass
+                    case _ if x in TERRAIN: tiles.place(i, j, *TERRAIN[x])
+                    case _ if x in CANOPY: canopy.place(i, j, *CANOPY[x])
                     case _: pass
+        self._field = pathfinding.DistanceField(self._gridmap, castle, {BRICK: SMART_ENEMY_BRICK_COST}) if self._smart_enemies else None
         self.spawn_player()
     
+    def close(self):
+        """ Deletes the chunks of the current city stored on disk. Called when the city or the whole game is discarded """
+        for layer in (self._gridmap.tiles, self._trees.tiles):
+            if isinstance(layer, chunks.ChunkedTileLayer): layer.close()
+
     def reset_level(self):
         """ Restarts the current level """
         if self._level in self._player_states: self._player, self._lives = self._player_states[self._level]
+        self._scheduler.clear(LEVEL_TIMERS) # Nothing of the level may fire after it, while power-ups run out as they would have
+        self._just_powered_up = False
         self._gridmap.clear()
         self._trees.clear()
         self._enemies.clear()
-        self._bullets.clear()
-        self._explosions.clear()
+        for bullet in self._bullets.copy(): self.release_bullet(bullet)
+        for explosion in self._explosions.copy(): self.release_explosion(explosion)
         self._powerups.clear()
         self._wave = 1
         self.load()
@@ -511,155 +635,224 @@ class GameState:
 
     def spawn_player(self):
         """ Spawns a player on player spawn point if it exists """
+        if self._player in self._gridmap: return # A respawn can be pending when the level is reset
         for r, row in enumerate(self._city):
+            if 'P' not in row: continue
             for c, x in enumerate(row):
                 if x == 'P':
-                    self._gridmap.replace(r, c, self._player)
+                    try: self._gridmap.replace(r, c, self._player)
+                    except ValueError: self._scheduler.after(TICK_RATE, self.spawn_player, LEVEL_TIMERS) # A tank is in the way, try again in a second
 
     def update(self):
         """ Updates state """
-        for enemy in self._enemies:
+        lap = self._profiler.lap
+        lap('session') # Whatever ran before this tick, like the input handling of Session
+        self._scheduler.tick()
+        self._previous = {bullet: pos for bullet, (pos, _) in self._bullets.items()}
+        lap('timers')
+        for enemy, (dir, shoots) in zip(self._enemies, enemy_rolls(self._rng, len(self._enemies))):
             """ Updates all enemies' action with AI """
-            if random.random() < ENEMY_MOVEMENT_CHANCE:  # Chance to move 
-                dir: Directions = random.choice(['N', 'W', 'S', 'E']) # Choose random direction
-                if random.random() < ENEMY_REDIRECT_CHANCE:  # Chance to change direction 
-                    self.move_to(dir, enemy)
-            if not enemy.shot and random.random() < ENEMY_SHOOT_CHANCE: # Chance to shoot
+            if dir is not None:
+                if self._field and (path := self._field.toward(*self._gridmap.find(enemy))): dir = path # type: ignore # Smart enemies only pick the way
+                self.move_to(dir, enemy)
+            if shoots and not enemy.shot:
                 enemy.shot = True
                 self.spawnBullet(enemy)
+        lap('enemy ai')
+
+        order = {bullet: n for n, bullet in enumerate(self._bullets)} # bullet-to-bullet collisions resolve in bullet order
+        broadphase: collision.SpatialHash[Bullet] = collision.SpatialHash(BULLET_BROADPHASE_CELL)
+        for bullet in self._bullets: broadphase.insert(bullet, self.bullet_collider(bullet))
+        tiles = self._gridmap.tiles
+        lap('bullet vs bullet')
 
-        for bullet, ((x, y), tank) in self._bullets.copy().items(): 
+        for bullet, (_, tank) in self._bullets.copy().items(): 
             """ Updates all bullets and checks collisions """
-            if bullet not in self._bullets: continue
-            
-            X, Y = self.bullet_collider(bullet)
-            objects = set(self.scan(X, Y))
-            bullet_dmg = 0
-            for obj in objects:                
-                if isinstance(obj, Tank) and ((tank == self._player and obj in self._enemies) or (obj == self._player)): # handles tank bullet collisions 
-                    if obj.invulnerable: bullet_dmg += bullet.hp
-                    else:
-                        bullet_dmg += 1
-                        self.explosions[obj.explosion] = self.locate(obj)
-                        sounds.tank_explosion()
-                        self._gridmap.remove(obj)
-                        
-                        if obj in self._enemies: self._enemies.remove(obj)
-                        else: 
-                            self._lives -= 1
-                            if self._lives: 
-                                self._player = FriendTank()
-                                Timer(1, self.spawn_player).start() # 1 second timer before respawning
+            travel = bullet.speed//TICK_RATE
+            while travel and bullet in self._bullets: # Fast bullets move in steps no longer than themselves, so they can't skip past anything
+                (x, y), _ = self._bullets[bullet]
+                step = min(travel, self.bullet_extent(bullet))
+                travel -= step
+
+                X, Y = self.bullet_collider(bullet)
+                objects = dict.fromkeys(self.scan(X, Y)) # Ordered set of the objects and terrain cells hit, in scan order
+                bullet_dmg = 0
+                for obj in objects:                
+                    if isinstance(obj, tuple): # handles terrain collisions, tiles are found by cell
+                        r, c = obj
+                        code = tiles.code(r, c)
+                        if code == BRICK: 
+                            bullet_dmg += tiles.hp(r, c)
+                            self._dirty_cells.append(obj)
+                            if tiles.hit(r, c, bullet.hp) <= 0: 
+                                tiles.remove(r, c)
+                                if self._field: self._field.open(r, c)
+
+                        elif code in MIRRORS and obj != bullet.last_mirror: # handles mirror bullet collisions
+                            obj_x, obj_y = c*self._gridmap.cellwidth, r*self._gridmap.cellheight
+                            if code == MIRROR_POSITIVE:
+                                for dx, dy in zip((0, self._gridmap.cellwidth), (0, self._gridmap.cellheight)):
+                                    if (obj_x + self._gridmap.cellwidth - dx) in X and (obj_y + dy) in Y:
+                                        reflect(bullet, True, obj)
+                                        break
+                                else: continue
+                                break # break out of outer loop if inner loop was broken
                             else: 
-                                sounds.stop_bgm()
-                                sounds.game_over()
-
-                if isinstance(obj, (Brick)): # handles brick collisions
-                    bullet_dmg += obj.hp
-                    obj.hit(bullet.hp)
-                    if obj.hp <= 0: self._gridmap.remove(obj)
-
-                if isinstance(obj, Castle): # handles castle collision
-                    self.explosions[Explosion(Texture(1, 0, 32, 16, 16))] = self.locate(obj)
-                    self._gridmap.remove(obj)
-                    sounds.tank_explosion()
-                    Timer(1.00, partial(self.__setattr__, 'lives', 0)).start()
-                    Timer(1.00, partial(sounds.game_over)).start()
-
-                if isinstance(obj, Mirror) and obj != bullet.last_mirror: # handles mirror bullet collisions
-                    obj_x, obj_y = self.locate(obj)
-                    if obj.type:
-                        for dx, dy in zip((0, self._gridmap.cellwidth), (0, self._gridmap.cellheight)):
-                            if (obj_x + self._gridmap.cellwidth - dx) in X and (obj_y + dy) in Y:
-                                obj.reflect(bullet)
-                                break
-                        else: continue
-                        break # break out of outer loop if inner loop was broken
-                    else: 
-                        for dx, dy in zip((0, self._gridmap.cellwidth), (0, self._gridmap.cellheight)):
-                            if (obj_x + dx) in X and (obj_y + dy) in Y:
-                                obj.reflect(bullet)
+                                for dx, dy in zip((0, self._gridmap.cellwidth), (0, self._gridmap.cellheight)):
+                                    if (obj_x + dx) in X and (obj_y + dy) in Y:
+                                        reflect(bullet, False, obj)
+                                        break
+                                else: continue
                                 break
-                        else: continue
-                        break
-                                
-                if isinstance(obj, Stone): # handles stone collision
-                    bullet_dmg += bullet.hp
+
+                        elif code == STONE: # handles stone collision
+                            bullet_dmg += bullet.hp
+                        continue
+
+                    if isinstance(obj, Tank) and ((tank == self._player and obj in self._enemies) or (obj == self._player)): # handles tank bullet collisions 
+                        if obj.invulnerable: bullet_dmg += bullet.hp
+                        else:
+                            bullet_dmg += 1
+                            self.explode(obj.explosion_texture, self.locate(obj))
+                            self._audio.tank_explosion()
+                            self._gridmap.remove(obj)
+                        
+                            if obj in self._enemies: del self._enemies[obj]
+                            else: 
+                                self._lives -= 1
+                                if self._lives: 
+                                    self._player = FriendTank()
+                                    self._scheduler.after(TICK_RATE, self.spawn_player, LEVEL_TIMERS) # 1 second timer before respawning
+                                else: 
+                                    self._audio.stop_bgm()
+                                    self._audio.game_over()
+
+                    if isinstance(obj, Castle): # handles castle collision
+                        self.explode(Texture(1, 0, 32, 16, 16), self.locate(obj))
+                        self._gridmap.remove(obj)
+                        self._audio.tank_explosion()
+                        self._scheduler.after(TICK_RATE, partial(self.__setattr__, 'lives', 0), LEVEL_TIMERS)
+                        self._scheduler.after(TICK_RATE, self._audio.game_over, LEVEL_TIMERS)
             
-            for bullet2 in self._bullets.copy(): # handles bullet-to-bullet collisions
-                if bullet2 is not bullet and self.check_collision(self.bullet_collider(bullet), self.bullet_collider(bullet2)): # all bullets should collide with each other
-                    bullet_dmg += bullet2.hp
-                    bullet2.hit(bullet.hp)
-
-                    if bullet2.hp <= 0:
-                        self._bullets[bullet2][1].shot = False
-                        self.explosions[bullet2.explosion] = self._bullets[bullet2][0]
-                        if self._bullets[bullet2][1] == self._player: bullet2.sound('explode')
-                        self._bullets.pop(bullet2)
-                        break
-            bullet.hp -= bullet_dmg
+                lap('bullets')
+                for bullet2 in sorted(broadphase.query((X, Y)), key=order.__getitem__): # handles bullet-to-bullet collisions, only nearby bullets can collide
+                    if bullet2 is not bullet and self.check_collision((X, Y), self.bullet_collider(bullet2)): # all bullets should collide with each other
+                        bullet_dmg += bullet2.hp
+                        bullet2.hit(bullet.hp)
+
+                        if bullet2.hp <= 0:
+                            self._bullets[bullet2][1].shot = False
+                            self.explode(bullet2.explosion_texture, self._bullets[bullet2][0])
+                            if self._bullets[bullet2][1] == self._player: bullet2.sound('explode', self._audio)
+                            self.release_bullet(bullet2)
+                            broadphase.remove(bullet2)
+                            break
+                lap('bullet vs bullet')
+                bullet.hp -= bullet_dmg
                 
-            if any(map(lambda obj: isinstance(obj, Tank) and obj.invulnerable, objects)) or bullet.hp  <= 0 or bullet.steps > BULLET_MOVEMENT_LIMIT: 
-                # Removes bullet 
-                tank.shot = False
-                self.explosions[bullet.explosion] = x, y
-                if tank == self._player and not any(map(lambda obj: isinstance(obj, Tank) and not obj.invulnerable, objects)): bullet.sound('explode')
-                self._bullets.pop(bullet)
-            else:
-                # Update bullet's position
-                match bullet.facing:
-                    case 'N':
-                        if min(Y) <= 0: bullet.facing = 'S'
-                        else: y -= bullet.speed//FPS
-                    case 'W':
-                        if min(X) <= 0: bullet.facing = 'E'
-                        else: x -= bullet.speed//FPS
-                    case 'S':
-                        if max(Y) >= self._gridmap.height - 1: bullet.facing = 'N'
-                        else: y += bullet.speed//FPS
-                    case 'E':
-                        if max(X) >= self._gridmap.width - 1: bullet.facing = 'W'
-                        else: x += bullet.speed//FPS
-                bullet.steps += bullet.speed//FPS
-                self._bullets[bullet] = (x, y), tank
-                if isinstance(bullet, MagicArrow): bullet.update()
+                if any(map(lambda obj: isinstance(obj, Tank) and obj.invulnerable, objects)) or bullet.hp  <= 0 or bullet.steps > BULLET_MOVEMENT_LIMIT: 
+                    # Removes bullet 
+                    tank.shot = False
+                    self.explode(bullet.explosion_texture, (x, y))
+                    if tank == self._player and not any(map(lambda obj: isinstance(obj, Tank) and not obj.invulnerable, objects)): bullet.sound('explode', self._audio)
+                    self.release_bullet(bullet)
+                    broadphase.remove(bullet)
+                else:
+                    # Update bullet's position
+                    match bullet.facing:
+                        case 'N':
+                            if min(Y) <= 0: bullet.facing = 'S'
+                            else: y -= step
+                        case 'W':
+                            if min(X) <= 0: bullet.facing = 'E'
+                            else: x -= step
+                        case 'S':
+                            if max(Y) >= self._gridmap.height - 1: bullet.facing = 'N'
+                            else: y += step
+                        case 'E':
+                            if max(X) >= self._gridmap.width - 1: bullet.facing = 'W'
+                            else: x += step
+                    bullet.steps += step
+                    self._bullets[bullet] = (x, y), tank
+                    broadphase.move(bullet, self.bullet_collider(bullet))
+            if bullet in self._bullets and isinstance(bullet, MagicArrow): bullet.update()
+        lap('bullets')
 
         for explosion in self.explosions.copy():
             """ Updates all the explosions """
             if explosion.animation.done:
-                self.explosions.pop(explosion)
+                self.release_explosion(explosion)
             explosion.update()
+        lap('explosions')
 
         for power, (x,y) in self.powerups.copy().items():
             """ Updates all powerups and handles their player collision """
             if self._player in self._gridmap and (x*self.gridmap.cellwidth, y*self.gridmap.cellheight) == self.locate(self._player) and len(self._player.powerups) < 3:
                 self.powerups.pop(power)
-                self._player.powerup(power)
+                self.powerup(self._player, power)
                 self._just_powered_up = True
-                Timer(POWERUP_SPAWN_TIMER_SEC, self.__setattr__, ('_just_powered_up', False)).start()
+                self._scheduler.after(POWERUP_SPAWN_TIMER_SEC*TICK_RATE, partial(self.__setattr__, '_just_powered_up', False), LEVEL_TIMERS)
+        lap('powerups')
 
         if self._wave < 3 and not (self._enemies or self._bullets):
             """ Spawns more enemies once they're wiped out """
-            for i, j in MapLoader(self._level).enemy_location():
-                enemy = random.choice((EnemyTank(), MagicTank())) if self._wave >= 2 else EnemyTank()
+            for i, j in self._map.enemy_location():
+                enemy = self._rng.choice((EnemyTank(), MagicTank())) if self._wave >= 2 else EnemyTank()
                 try: 
                     self._gridmap.replace(i, j, enemy)
                 except ValueError:
                     continue
-                self._enemies.add(enemy)
+                self._enemies[enemy] = None
             self._wave += 1  
+        lap('waves')
 
         if not self.powerups and self._wave >= 2 and not self._just_powered_up:
             """ Generates random power up on one of the fixed locations from tilemap """
-            if (pu_spawns:= MapLoader(self._level).power_up_location()):
-                (y, x) = random.choice(pu_spawns) # power up location
-                self.powerups[random.choice((AttackBoost(), DefenseBoost()))] = x, y
+            if (pu_spawns:= self._map.power_up_location()):
+                (y, x) = self._rng.choice(pu_spawns) # power up location
+                self.powerups[self._rng.choice((AttackBoost(), DefenseBoost()))] = x, y
+        lap('powerups')
+
+        if self._chunked:
+            """ Lets go of the terrain far from every tank """
+            near = [self._gridmap.find(tank) for tank in (self._player, *self._enemies) if tank in self._gridmap]
+            for layer in (tiles, self._trees.tiles): layer.keep(near, CHUNK_RADIUS) # type: ignore
+            lap('chunks')
+
+    def powerup(self, tank: Tank, power: PowerUp, duration_sec: int = 10):
+        """ Gives a tank a timed power """
+        tank.powerup(power)
+        if isinstance(power, Evolved): # Both Boosts
+            self.powerup(tank, AttackBoost(), duration_sec)
+            self.powerup(tank, DefenseBoost(), duration_sec)
+        self._audio.powered_up()
+        self._scheduler.after(duration_sec*TICK_RATE, partial(tank.powerdown, power))
+
+    def state_hash(self) -> str:
+        """ Returns a digest of everything that affects how the game plays out from this frame on. Equal seeds and inputs give equal hashes every frame """
+        tank = lambda obj: (obj.facing, obj.shot, obj.invulnerable, tuple(type(power).__name__ for power in obj.powerups))
+        state = (
+            self.frame, self._level, self._wave, self._lives, self._just_powered_up, len(self._scheduler), self._rng.getstate(),
+            tank(self._player),
+            [(cell, TILE_NAMES[obj], self._gridmap.tiles.hp(*cell) if obj == BRICK else None, None) if isinstance(obj, int) else (cell, type(obj).__name__, None, tank(obj) if isinstance(obj, Tank) else None)
+             for cell, obj in self.contents(terrain = not self._chunked)],
+            [(pos, type(bullet).__name__, bullet.facing, bullet.hp, bullet.steps) for bullet, (pos, _) in self._bullets.items()],
+            [(pos, explosion.animation.frame) for explosion, pos in self._explosions.items()],
+            [(pos, type(power).__name__) for power, pos in self._powerups.items()],
+        )
+        if self._chunked: state += (self._gridmap.tiles.changes(),) # type: ignore # Chunks untouched since they were read from the city are the same in every game of it
+        return hashlib.blake2b(repr(state).encode(), digest_size=8).hexdigest()
 
     def locate(self, obj: grid.GridObject) -> Position:
         """ Locates (x, y) coords of GridObject relative to map """
         r, c =  self._gridmap.find(obj)
         return c*self._gridmap.cellwidth, r*self._gridmap.cellheight
     
+    def bullet_extent(self, bullet: Bullet) -> int:
+        """ Returns the length of a bullet's collider along the direction it flies """
+        X, Y = bullet.collider
+        return len(Y) if bullet.facing in ('N', 'S') else len(X)
+
     def bullet_collider(self, bullet: Bullet) -> CollisionRect:
         """ Returns collider of bullet relative to map """
         (x, y), _ = self._bullets[bullet]
@@ -669,13 +862,16 @@ class GameState:
     def scan(self, 
             X: range, # range of x values
             Y: range, # range of y values
-            ) -> Iterator[grid.GridObject]:
-        """ Scans subgrid of x, y values for GridObjects """
-        for x in X:
-            for y in Y:
-                if 0 <= x < DISPLAY_WIDTH and 0 <= y < DISPLAY_HEIGHT:
-                    obj = self._gridmap.table[y//self._gridmap.cellheight][x//self._gridmap.cellwidth]
-                    if obj is not None: yield obj
+            ) -> Iterator[grid.GridObject | grid.Cell]:
+        """ Scans subgrid of x, y values for GridObjects, and for the cells of terrain tiles """
+        g = self._gridmap
+        tiles = g.tiles
+        R, C = collision.cells((X, Y), g.cellwidth, g.cellheight, g.width, g.height)
+        for c in C: # Columns first, same order as scanning x then y
+            for r in R:
+                obj = g.table[r][c]
+                if obj is not None: yield obj
+                elif tiles.code(r, c): yield r, c
 
     def move_to(self, dir: Directions, obj: grid.GridObject, cells: int = 1):
         """ Moves GridObjects in cardinal directions on map with clamping """
@@ -688,13 +884,15 @@ class GameState:
             case 'E':  c += cells
         if isinstance(obj, Tank): obj.facing = dir
         r, c = max(min(obj.R), min(r, self._gridmap.rows-1-max(obj.R))), max(min(obj.C), min(c, self._gridmap.cols-1-max(obj.C))) # Autoclamping
-        for other in self._gridmap.scan(range(r + obj.R.start, r + obj.R.stop), range(c + obj.C.start, c + obj.C.stop)):
-            if other != obj: return
+        if self._gridmap.blocked(range(r + obj.R.start, r + obj.R.stop), range(c + obj.C.start, c + obj.C.stop), obj): return
         self._gridmap.move(obj, r, c)
     
     def spawnBullet(self, tank: Tank, buffer: int = 0):
         """ Spawns bullets outside of the collider of the Tank they came from with positional buffer """
-        (x, y), bullet = self.locate(tank), tank.bullet
+        kind = tank.bullet_kind
+        (x, y), bullet = self.locate(tank), self._bullet_pool.acquire(kind, lambda: tank.bullet)
+        bullet.reset(tank.facing)
+        self._bullet_kinds[bullet] = kind
         X, Y = bullet.collider
         match tank.facing:
             case 'N':
@@ -707,92 +905,296 @@ class GameState:
                 x += len(tank.C)*self._gridmap.cellwidth - min(X) + buffer
         self._bullets[bullet] = (x, y), tank
         tank.shot = True
-        if tank == self.player: bullet.sound('shot')
+        if tank == self.player: bullet.sound('shot', self._audio)
+    
+    def release_bullet(self, bullet: Bullet):
+        """ Removes a bullet from play and returns it to the pool """
+        self._bullets.pop(bullet)
+        self._bullet_pool.release(self._bullet_kinds.pop(bullet), bullet)
+
+    def explode(self, texture: Texture, pos: Position):
+        """ Plays an explosion starting from texture at pos, reusing a finished one if possible """
+        explosion = self._explosion_pool.acquire(texture, partial(Explosion, texture))
+        explosion.reset()
+        self._explosions[explosion] = pos
+
+    def release_explosion(self, explosion: Explosion):
+        """ Removes an explosion and returns it to the pool """
+        self._explosions.pop(explosion)
+        self._explosion_pool.release(explosion.origin, explosion)
     
     def check_collision(self, collider1: CollisionRect, collider2: CollisionRect) -> bool:
         """ Checks if two colliders overlap with each other """
-        X1, Y1 = collider1
-        X2, Y2 = collider2
-        for x in X1:
-            for y in Y1:
-                if x in X2 and y in Y2: return True
-        return False
+        return collision.overlaps(collider1, collider2)
     
-    def drawspecs(self) -> Iterator[tuple[int, int, Texture]]:
-        """ Returns an iterator of all object textures and their positions within the canvas """
-        for (r, c), obj in self.gridmap.enumerate():
-            if isinstance(obj, (Tank, Brick, Water, Stone, Tree, Mirror, Castle)): 
-                yield c*self.gridmap.cellwidth, r*self.gridmap.cellheight, obj.texture
+    def take_dirty_cells(self) -> list[grid.Cell]:
+        """ Returns the distinct cells whose terrain changed since the last call, such as hit or destroyed bricks """
+        cells, self._dirty_cells = list(dict.fromkeys(self._dirty_cells)), []
+        return cells
+
+    def contents(self, terrain: bool = True) -> list[tuple[grid.Cell, grid.GridObject | int]]:
+        """ 
+        Returns every grid object and, unless terrain is False, terrain tile code of the map with its cell, in row-major order.
+        Chunked maps only give the tiles of the chunks in memory, as reading the others would load the whole map
+        """
+        tiles = (self._gridmap.tiles.enumerate(loaded = True) if self._chunked else self._gridmap.tiles.enumerate()) if terrain else () # type: ignore
+        return sorted([*self._gridmap.enumerate(), *tiles], key=lambda item: item[0]) # Objects and tiles never share a cell
+
+    def terrain_drawspecs(self, cells: Iterator[grid.Cell] | None = None) -> Iterator[tuple[int, int, Texture]]:
+        """ Returns the textures and positions of the static terrain below tanks, of the whole map or only of the given cells """
+        tiles = self.gridmap.tiles
+        for (r, c), code in tiles.enumerate() if cells is None else ((cell, tiles.code(*cell)) for cell in cells):
+            if code: yield c*self.gridmap.cellwidth, r*self.gridmap.cellheight, terrain_texture(code, r, c, tiles.hp(r, c))
+
+    def visible(self, view: CollisionRect, terrain: bool = True) -> Iterator[tuple[grid.Cell, grid.GridObject | int]]:
+        """ 
+        Returns the grid objects, and the terrain tiles unless terrain is False, that show within a view of (X, Y) pixels, with their cells, in row-major order.
+        Objects are found through the grid's index, so only terrain takes a walk over the cells in view
+        """
+        g = self._gridmap
+        R, C = collision.cells(view, g.cellwidth, g.cellheight, g.width, g.height)
+        objects = g.within(R, C)
+        if not terrain: 
+            yield from objects
+            return
+        tiles = g.tiles
+        yield from sorted([*objects, *(((r, c), code) for r in R for c in C if (code := tiles.code(r, c)))], key=lambda item: item[0]) # Objects and tiles never share a cell
+
+    def canopy_drawspecs(self, view: CollisionRect | None = None) -> Iterator[tuple[int, int, Texture]]:
+        """ Returns the textures and positions of the trees, which are drawn over everything else, of the whole map or only within view """
+        tiles = self._trees.tiles
+        if view is None: cells = tiles.enumerate()
+        else:
+            R, C = collision.cells(view, self.gridmap.cellwidth, self.gridmap.cellheight, self.gridmap.width, self.gridmap.height)
+            cells = (((r, c), code) for r in R for c in C if (code := tiles.code(r, c)))
+        for (r, c), code in cells:
+            yield c*self.gridmap.cellwidth, r*self.gridmap.cellheight, terrain_texture(code, r, c)
+
+    def drawspecs(self, terrain: bool = True, alpha: float = 1.0, view: CollisionRect | None = None) -> Iterator[tuple[int, int, Texture]]:
+        """ 
+        Returns an iterator of all object textures and their positions within the canvas. Static terrain and trees are left out if terrain is False.
+        Bullets are drawn alpha of the way from where they were before the last update to where they are now, for frames that fall between ticks.
+        Given a view of (X, Y) pixels, only what shows within it is returned, so drawing costs the same however large the map is
+        """
+        shows: Callable[[int, int], bool]
+        if view is None: objects, shows = self.contents() if terrain else self.gridmap.enumerate(), lambda x, y: True
+        else:
+            (X, Y), objects = view, self.visible(view, terrain)
+            shows = lambda x, y: X.start - 16 < x < X.stop and Y.start - 16 < y < Y.stop # Sprites are at most 16px
+        for (r, c), obj in objects:
+            if isinstance(obj, int): texture = terrain_texture(obj, r, c, self.gridmap.tiles.hp(r, c))
+            elif isinstance(obj, (Tank, Castle)): texture = obj.texture
+            else: continue # Only tanks and the castle are drawn off the grid
+            yield c*self.gridmap.cellwidth, r*self.gridmap.cellheight, texture
         
         for bullet, ((x, y), _) in self.bullets.items():
-            yield x, y, bullet.texture
+            if alpha < 1 and (previous := self._previous.get(bullet)) is not None: # Bullets fired this tick have nowhere to come from
+                x, y = round(previous[0] + (x - previous[0])*alpha), round(previous[1] + (y - previous[1])*alpha)
+            if shows(x, y): yield x, y, bullet.texture
 
         for explosion, (x, y) in self.explosions.items():
-            yield x, y, explosion.texture
+            if shows(x, y): yield x, y, explosion.texture
 
         for powerup, (x, y) in self.powerups.items():
-            yield x*self.gridmap.cellwidth, y*self.gridmap.cellheight, powerup.texture
+            x, y = x*self.gridmap.cellwidth, y*self.gridmap.cellheight
+            if shows(x, y): yield x, y, powerup.texture
 
-        for (r, c), obj in self._trees.enumerate():
-            if isinstance(obj, (Tank, Brick, Water, Stone, Tree, Mirror, Castle)): 
-                yield c*self.gridmap.cellwidth, r*self.gridmap.cellheight, obj.texture
+        if terrain: yield from self.canopy_drawspecs(view)
     
-class BattleCity:
-    def __init__(self):
-        px.init(DISPLAY_WIDTH, DISPLAY_HEIGHT, title="BattleCity", fps = FPS)
-        px.load("my_resource.pyxres")
-        self.state = GameState() 
+class Session:
+    """ 
+    A play session from the main menu on, independent of pyxel. Applies each frame's player input to the GameState and starts a new game after a game over or the credits.
+    New games get their seeds from the session's seed, so a seed and an input stream always replay the same session.
+    """
+    def __init__(self, backend: backends.Backend | None = None, seed: int | None = SEED, smart_enemies: bool = SMART_ENEMIES, profile: profiler.Profiler | None = None) -> None:
+        self._backend = backend if backend is not None else backends.pyxel()
+        self._smart_enemies = smart_enemies
+        self._profiler = profile # Handed to every new game
+        self._seed = seed if seed is not None else random.randrange(2**32)
+        self._rng = random.Random(self._seed)
+        self.state = self.new_game()
         self.key_input: str = '' # cheat code input
-        px.run(self.update, self.draw)
 
-    def update(self):
-        """ Handles user input """
-        if px.btn(px.KEY_LCTRL) or px.btn(px.KEY_RCTRL):
-            if px.btnp(px.KEY_S) and self.state.level == 0:
+    @property
+    def seed(self): return self._seed
+
+    def new_game(self) -> GameState:
+        """ Returns a GameState on the main menu """
+        return GameState(0, self._backend, self._rng.randrange(2**32), self._smart_enemies, self._profiler)
+
+    def update(self, inp: controls.Input):
+        """ Handles user input and updates the state by one frame """
+        if inp.btn(controls.KEY_CTRL):
+            if inp.btnp(controls.KEY_S) and self.state.level == 0:
                 self.state.next_level()
-            if px.btnp(px.KEY_R) and self.state.level > 0:
+            if inp.btnp(controls.KEY_R) and self.state.level > 0:
                 self.state.reset_level()
 
         if self.state.level > MapLoader.LEVELS:
-            if px.btnp(px.KEY_SPACE):
-                self.state = GameState() # Go back to menu
+            if inp.btnp(controls.KEY_SPACE):
+                self.state.close()
+                self.state = self.new_game() # Go back to menu
         elif self.state.is_gameover:
-            if px.btnp(px.KEY_SPACE):
-                self.state = GameState()
+            if inp.btnp(controls.KEY_SPACE):
+                self.state.close()
+                self.state = self.new_game()
             return
         
         if not self.state.enemies and self.state.wave >= 3:
-            if not self.state.bullets and px.btnp(px.KEY_SPACE):
+            if not self.state.bullets and inp.btnp(controls.KEY_SPACE):
                 self.state.next_level()
         else:
             # cheat code input buffer
-            for n in range(97, 123): # a-z
-                if px.btnp(n): self.key_input += chr(n)
+            for n in controls.LETTERS: # a-z
+                if inp.btnp(n): self.key_input += controls.letter(n)
                 
             if UNDYING_CHEAT_CODE in self.key_input:
-                self.state.player.powerup(DefenseBoost(), 10**6)
+                self.state.powerup(self.state.player, DefenseBoost(), 10**6)
                 self.key_input = ''  # Resets the input when the cheat is activated
             elif HEALTH_CHEAT_CODE in self.key_input:
                 self.state.lives += 2
                 self.key_input = ''
-                sounds.powered_up()
+                self._backend.audio.powered_up()
             elif MAGIC_CHEAT_CODE in self.key_input:
-                self.state.player.powerup(AttackBoost(), 10**6)
+                self.state.powerup(self.state.player, AttackBoost(), 10**6)
                 self.key_input = ''
             if self.state.player in self.state.gridmap:
-                if px.btnp(px.KEY_SPACE) and not self.state.player.shot and not any(map(lambda k: px.btn(k), (px.KEY_W, px.KEY_A, px.KEY_S, px.KEY_D))):
+                if inp.btnp(controls.KEY_SPACE) and not self.state.player.shot and not any(map(inp.btn, (controls.KEY_W, controls.KEY_A, controls.KEY_S, controls.KEY_D))):
                     self.state.spawnBullet(self.state.player)
 
-                if px.btn(px.KEY_W) and  px.frame_count*PLAYER_MOVEMENT_SPD % FPS*self.state.gridmap.cellheight == 0: self.state.move_to('N', self.state.player)
-                elif px.btn(px.KEY_D) and  px.frame_count*PLAYER_MOVEMENT_SPD % FPS*self.state.gridmap.cellwidth == 0: self.state.move_to('E', self.state.player)
-                elif px.btn(px.KEY_A) and  px.frame_count*PLAYER_MOVEMENT_SPD % FPS*self.state.gridmap.cellwidth == 0: self.state.move_to('W', self.state.player)
-                elif px.btn(px.KEY_S) and  px.frame_count*PLAYER_MOVEMENT_SPD % FPS*self.state.gridmap.cellheight == 0: self.state.move_to('S', self.state.player)
+                if inp.btn(controls.KEY_W) and  self.state.frame*PLAYER_MOVEMENT_SPD % TICK_RATE*self.state.gridmap.cellheight == 0: self.state.move_to('N', self.state.player)
+                elif inp.btn(controls.KEY_D) and  self.state.frame*PLAYER_MOVEMENT_SPD % TICK_RATE*self.state.gridmap.cellwidth == 0: self.state.move_to('E', self.state.player)
+                elif inp.btn(controls.KEY_A) and  self.state.frame*PLAYER_MOVEMENT_SPD % TICK_RATE*self.state.gridmap.cellwidth == 0: self.state.move_to('W', self.state.player)
+                elif inp.btn(controls.KEY_S) and  self.state.frame*PLAYER_MOVEMENT_SPD % TICK_RATE*self.state.gridmap.cellheight == 0: self.state.move_to('S', self.state.player)
                 
         
         self.state.update()
+
+class TerrainLayer:
+    """ 
+    Static terrain of a level baked into images, so it is drawn with a blt per block of chunks.CHUNK cells instead of one per tile.
+    Blocks are baked as they come into view, and afterwards only the cells reported by GameState.take_dirty_cells are redrawn. Everything is baked again when a new city is loaded.
+    Blocks more than BLOCK_MARGIN blocks away from the view are dropped, so the images held don't grow with the map.
+    """
+    def __init__(self, canopy: bool = False):
+        self._canopy = canopy # Bakes the trees instead, which never change
+        self._state: GameState | None = None
+        self._version = 0
+        self._blocks: dict[grid.Cell, px.Image] = {} # Image of every block baked so far
+
+    def bake_block(self, state: GameState, br: int, bc: int) -> 'px.Image':
+        """ Bakes the cells of a block into a new image """
+        import pyxel as px
+        g, size = state.gridmap, chunks.CHUNK
+        R, C = range(br*size, min((br + 1)*size, g.rows)), range(bc*size, min((bc + 1)*size, g.cols))
+        X, Y = range(C.start*g.cellwidth, C.stop*g.cellwidth), range(R.start*g.cellheight, R.stop*g.cellheight)
+        image = self._blocks[br, bc] = px.Image(len(X), len(Y))
+        image.cls(0) # Transparent, like the color key of the tiles
+        specs = state.canopy_drawspecs((X, Y)) if self._canopy else state.terrain_drawspecs((r, c) for r in R for c in C)
+        for x, y, (img, u, v, w, h, colkey) in specs:
+            image.blt(x - X.start, y - Y.start, img, u, v, w, h, colkey)
+        return image
+
+    def draw(self, state: GameState, view: CollisionRect):
+        import pyxel as px
+        g, size = state.gridmap, chunks.CHUNK
+        if state is not self._state or state.terrain_version != self._version:
+            self._state, self._version = state, state.terrain_version
+            self._blocks.clear()
+            if not self._canopy: state.take_dirty_cells()
+        elif not self._canopy:
+            for r, c in state.take_dirty_cells():
+                if (image := self._blocks.get((r//size, c//size))) is None: continue # Blocks not baked yet are baked as they are
+                x, y = (c % size)*g.cellwidth, (r % size)*g.cellheight
+                image.rect(x, y, g.cellwidth, g.cellheight, 0)
+                for _, _, (img, u, v, w, h, colkey) in state.terrain_drawspecs(iter(((r, c),))): image.blt(x, y, img, u, v, w, h, colkey)
+        R, C = collision.cells(view, g.cellwidth, g.cellheight, g.width, g.height)
+        BR, BC = range(R.start//size, (R.stop - 1)//size + 1), range(C.start//size, (C.stop - 1)//size + 1)
+        visible = {(br, bc) for br in BR for bc in BC}
+        for br, bc in [(br, bc) for br, bc in self._blocks if not (BR.start - BLOCK_MARGIN <= br < BR.stop + BLOCK_MARGIN and BC.start - BLOCK_MARGIN <= bc < BC.stop + BLOCK_MARGIN)]:
+            del self._blocks[br, bc]
+        X, Y = view
+        for br, bc in sorted(visible):
+            if (image := self._blocks.get((br, bc))) is None: image = self.bake_block(state, br, bc)
+            x, y = bc*size*g.cellwidth, br*size*g.cellheight # Where the block starts
+            left, top = max(X.start, x), max(Y.start, y)
+            width, height = min(X.stop, x + image.width) - left, min(Y.stop, y + image.height) - top
+            if width > 0 and height > 0: px.blt(left, top, image, left - x, top - y, width, height, 0)
+
+class BattleCity:
+    """
+    The pyxel front end. It renders fps frames per second and runs the simulation at TICK_RATE ticks per second, however many that makes per frame.
+    """
+    def __init__(self, seed: int | None = SEED, record: str | None = None, smart_enemies: bool = SMART_ENEMIES, fps: int = FPS, turbo: int | None = None):
+        import pyxel as px
+        self.recorder = replay.Recorder(record) if record else None
+        self.fps = fps
+        if turbo is not None and turbo < 2: raise ValueError(f"Turbo runs at least 2 ticks per tick due, not {turbo}")
+        self.turbo = turbo if turbo is not None else TURBO # Ticks run for every tick due while turbo is on
+        self.turbo_on = turbo is not None
+        self._ticks = 0 # Ticks run since the rate was last measured
+        self._measured_at = time.perf_counter()
+        self.tick_rate: float = 0 # Measured ticks per second of real time
+        self._lead = 0 # How far the simulation is ahead of the display, in 1/(fps*TICK_RATE) seconds. Never negative after an update
+        self._pressed = 0 # Keys pressed since the last tick, so presses on frames without a tick aren't lost
+        self._focus: Position = (DISPLAY_WIDTH//2, DISPLAY_HEIGHT//2) # Where the camera looks, the player's last position
+        self.profiler = profiler.Profiler(PROFILE_WINDOW, enabled = False) # Times the phases of every frame while its overlay is shown
+        px.init(DISPLAY_WIDTH, DISPLAY_HEIGHT, title="BattleCity", fps = fps, quit_key = px.KEY_NONE if record else px.KEY_ESCAPE)
+        px.load("my_resource.pyxres")
+        self.terrain = TerrainLayer()
+        self.canopy = TerrainLayer(canopy = True)
+        self.session = Session(seed = seed, smart_enemies = smart_enemies, profile = self.profiler)
+        if self.recorder: self.recorder.start(self.session.seed, smart_enemies)
+        px.run(self.update, self.draw)
+
+    @property
+    def state(self): return self.session.state
+
+    def poll(self) -> controls.Input:
+        """ Reads this frame's keyboard input """
+        import pyxel as px
+        held = pressed = 0
+        for key, buttons in ((controls.KEY_SPACE, (px.KEY_SPACE,)), (controls.KEY_CTRL, (px.KEY_LCTRL, px.KEY_RCTRL)), *((n, (ord(controls.letter(n)),)) for n in controls.LETTERS)):
+            if any(map(px.btn, buttons)): held |= 1 << key
+            if any(map(px.btnp, buttons)): pressed |= 1 << key
+        return controls.Input(held, pressed)
+
+    @property
+    def alpha(self) -> float:
+        """ Returns how far the display is from the tick before the last one to the last one, for drawing in between """
+        return 1 - self._lead/self.fps
+
+    def update(self):
+        """ Handles user input and runs the ticks that are due by this frame """
+        import pyxel as px
+        self.profiler.frame() # A frame runs from one update to the next
+        inp = self.poll()
+        if self.recorder and px.btnp(px.KEY_ESCAPE): # Saves the recording before quitting
+            self.recorder.save(self.state.state_hash())
+            px.quit()
+        if px.btnp(px.KEY_TAB): self.turbo_on = not self.turbo_on
+        if px.btnp(px.KEY_F3): self.profiler.enabled = not self.profiler.enabled
+        self.profiler.lap('input')
+        self._pressed |= inp.pressed
+        self._lead -= TICK_RATE # A frame lasts TICK_RATE units, a tick fps units
+        while self._lead < 0:
+            for _ in range(self.turbo if self.turbo_on else 1): # Turbo runs the extra ticks without drawing them
+                self.tick(controls.Input(inp.held, self._pressed))
+                self._pressed = 0 # A press only counts for one tick
+            self._lead += self.fps
+        if (elapsed := time.perf_counter() - self._measured_at) >= 1: # Measured over about a second, so the number stays readable
+            self.tick_rate, self._ticks, self._measured_at = self._ticks/elapsed, 0, self._measured_at + elapsed
+        self.profiler.lap('session')
+
+    def tick(self, inp: controls.Input):
+        """ Updates the simulation by one tick """
+        if self.recorder: self.recorder.record(inp)
+        self.session.update(inp)
+        self._ticks += 1
     
     def draw_top_ui(self):
         """ UI on top while in game that tells the player its health and current power up of the player """
+        import pyxel as px
         start_1 = 43 # starting x coord
         start_2 = 155 # starting x coord for power up
         
@@ -809,7 +1211,21 @@ class BattleCity:
         for i, power in enumerate(self.state.player.powerups): # Current powerups
             px.blt(200 + i*18, 0, *power.texture)
 
+        if self.turbo_on: # Simulation headroom, just below the bar
+            text = f"TURBO x{self.turbo} {self.tick_rate:.0f} TICKS/S"
+            px.text(DISPLAY_WIDTH - 4*len(text) - 1, 18, text, px.COLOR_YELLOW)
+
+    def draw_profile(self):
+        """ Overlay of the milliseconds each phase took per frame over the last PROFILE_WINDOW frames, at the percentiles of profiler.PERCENTILES """
+        import pyxel as px
+        lines = [f"{'MS/FRAME':<16}" + ''.join(f"{'P' + str(p):>7}" for p in profiler.PERCENTILES)]
+        lines += [f"{phase.upper():<16}" + ''.join(f"{ms:>7.2f}" for ms in times) for phase, times in self.profiler.summary()]
+        px.rect(0, 26, 4*len(lines[0]) + 3, 6*len(lines) + 3, px.COLOR_BLACK)
+        for i, line in enumerate(lines):
+            px.text(2, 28 + 6*i, line, px.COLOR_WHITE if i else px.COLOR_YELLOW)
+
     def draw_main_menu(self):
+        import pyxel as px
         start_1 = 80
         start_2 = 85
         start_3 = 115
@@ -819,6 +1235,7 @@ class BattleCity:
             px.blt(start_3 + i, 192, 0, i, 176, 16, 16, 0)
 
     def draw_credits(self):
+        import pyxel as px
         px.cls(px.COLOR_BLACK)
         px.text((DISPLAY_WIDTH//2)-50, (DISPLAY_HEIGHT//2)-20, "THANKS FOR PLAYING!", px.COLOR_WHITE)
         px.text((DISPLAY_WIDTH//2)-50, (DISPLAY_HEIGHT//2)-10, "Made by:", px.COLOR_WHITE)
@@ -826,16 +1243,40 @@ class BattleCity:
         px.text((DISPLAY_WIDTH//2)-45, (DISPLAY_HEIGHT//2)+10, "Ivan Ahron L. Junio", px.COLOR_WHITE)
         px.text(5, DISPLAY_HEIGHT - 10, "Press Space to go back to menu", px.COLOR_WHITE)
 
+    def view(self) -> CollisionRect:
+        """ Returns the (X, Y) pixels of the map on screen, centered on the player as far as the edges of the map allow """
+        g = self.state.gridmap
+        if self.state.player in g:
+            x, y = self.state.locate(self.state.player)
+            self._focus = x + len(self.state.player.C)*g.cellwidth//2, y + len(self.state.player.R)*g.cellheight//2
+        x = max(0, min(self._focus[0] - DISPLAY_WIDTH//2, g.width - DISPLAY_WIDTH))
+        y = max(0, min(self._focus[1] - DISPLAY_HEIGHT//2, g.height - DISPLAY_HEIGHT))
+        return range(x, x + DISPLAY_WIDTH), range(y, y + DISPLAY_HEIGHT)
+
+    def draw_world(self):
+        """ Draws the map within view: the baked terrain, everything that moves on it, then the baked trees over them """
+        import pyxel as px
+        self.profiler.lap('hud') # Drawn before the world
+        view = self.view()
+        px.camera(view[0].start, view[1].start)
+        self.terrain.draw(self.state, view)
+        self.profiler.lap('terrain')
+        for x, y, texture in self.state.drawspecs(terrain = False, alpha = self.alpha, view = view):
+            px.blt(x, y, *texture)
+        self.profiler.lap('drawspecs')
+        self.canopy.draw(self.state, view)
+        px.camera()
+        self.profiler.lap('canopy')
+
     def draw(self):
+        import pyxel as px
         px.cls(1)
 
         if self.state.level > MapLoader.LEVELS:
             self.draw_credits()
         elif self.state.level > 0:
             self.draw_top_ui()
-
-            for x, y, texture in self.state.drawspecs():
-                px.blt(x, y, *texture)
+            self.draw_world()
 
             if self.state.is_gameover:
                 px.text((DISPLAY_WIDTH//2)-20, (DISPLAY_HEIGHT//2)-10, "GAMEOVER!", px.COLOR_RED)
@@ -844,9 +1285,24 @@ class BattleCity:
                 px.text((DISPLAY_WIDTH//2)-20, (DISPLAY_HEIGHT//2)-10, "YOU WIN!", px.COLOR_GREEN)
                 px.text((DISPLAY_WIDTH//2)-50, (DISPLAY_HEIGHT//2), "PRESS SPACE TO MOVE ON!", px.COLOR_GREEN)
         elif self.state.level == 0:
-            for x, y, texture in self.state.drawspecs():
-                px.blt(x, y, *texture)
+            self.draw_world()
             self.draw_main_menu()
+        self.profiler.lap('hud')
+        if self.profiler.enabled: self.draw_profile()
+
+def at_least(minimum: int) -> Callable[[str], int]:
+    """ Returns an argparse type for integers of at least minimum """
+    def integer(text: str) -> int: # Named for argparse, which reports 'invalid integer value' for text that isn't one
+        if (value := int(text)) < minimum: raise argparse.ArgumentTypeError(f"must be at least {minimum}, got {value}")
+        return value
+    return integer
 
 if __name__ == "__main__":
-    BattleCity()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Battle City: Fantasy Themed")
+    parser.add_argument("--seed", type=int, default=SEED, help="seed of the game's random decisions (default: random)")
+    parser.add_argument("--record", metavar="PATH", help="record the session's input to a replay file, saved when quitting with ESC")
+    parser.add_argument("--smart-enemies", action="store_true", default=SMART_ENEMIES, help="make enemies head for the castle")
+    parser.add_argument("--fps", type=at_least(1), default=FPS, help=f"frames drawn per second, the game itself always runs at {TICK_RATE} ticks per second (default: {FPS})")
+    parser.add_argument("--turbo", type=at_least(2), metavar="N", help=f"start in turbo, running N ticks per tick due. TAB toggles turbo (default N: {TURBO})")
+    args = parser.parse_args()
+    BattleCity(args.seed, args.record, args.smart_enemies, args.fps, args.turbo)
\ No newline at end of file
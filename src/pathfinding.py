@@ -0,0 +1,99 @@
+import grid
+import heapq
+from array import array
+from typing import Final, Iterable
+""" Distance fields that lead tanks to a goal through the terrain of a GridMap """
+
+UNREACHABLE: Final[int] = 0xFFFF
+STEPS: Final[tuple[tuple[str, int, int], ...]] = (('N', -1, 0), ('W', 0, -1), ('S', 1, 0), ('E', 0, 1)) # Direction and (dr, dc) of each move, in tie-breaking order
+
+class DistanceField:
+    """
+    Cost of the cheapest way from every cell to a goal, for objects of size x size cells. Cells are the top-left cell of the object, like GridMap.find.
+    A move costs 1, plus the cost of every tile under the object where it lands. Tiles without a cost in costs can't be crossed at all.
+    Other objects are ignored, since they move.
+
+    The field is built once per level with Dijkstra's algorithm. When a tile is destroyed, open() revisits only the cells that got closer.
+    """
+    def __init__(self, gridmap: grid.GridMap, goal: Iterable[grid.Cell], costs: dict[int, int] | None = None, size: int = 2) -> None:
+        self._gridmap = gridmap
+        self._goal = set(goal)
+        self._costs = costs or {}
+        self._size = size
+        self._rows = gridmap.rows - size + 1 # Cells where a whole object fits
+        self._cols = gridmap.cols - size + 1
+        self.rebuild()
+
+    @property
+    def distances(self):
+        """ Distance of every cell, row-major over the cells where a whole object fits """
+        return self._distances
+
+    def cost(self, r: int, c: int) -> int:
+        """ Returns the cost of moving an object onto cell, UNREACHABLE if it can't be crossed """
+        if not (0 <= r < self._rows and 0 <= c < self._cols): return UNREACHABLE
+        return self._enter[r*self._cols + c]
+
+    def distance(self, r: int, c: int) -> int:
+        """ Returns the cost of the cheapest way from cell to the goal, UNREACHABLE if there is no way """
+        if not (0 <= r < self._rows and 0 <= c < self._cols): return UNREACHABLE
+        return self._distances[r*self._cols + c]
+
+    def toward(self, r: int, c: int) -> str | None:
+        """ Returns the direction of the first move of the cheapest way from cell to the goal, None if there is none """
+        best, dir = UNREACHABLE, None
+        for step, dr, dc in STEPS:
+            if (d := self.cost(r + dr, c + dc) + self.distance(r + dr, c + dc)) < best: best, dir = d, step
+        return dir if best <= self.distance(r, c) else None
+
+    def rebuild(self):
+        """ Computes the whole field from scratch """
+        self._enter = array('H', [UNREACHABLE])*(self._rows*self._cols)
+        self._distances = array('H', [UNREACHABLE])*(self._rows*self._cols)
+        goal: list[tuple[int, grid.Cell]] = []
+        for r in range(self._rows):
+            for c in range(self._cols):
+                self._enter[r*self._cols + c] = self._price(r, c)
+                if self._enter[r*self._cols + c] != UNREACHABLE and self._at_goal(r, c):
+                    self._distances[r*self._cols + c] = 0
+                    goal.append((0, (r, c)))
+        self._relax(goal)
+
+    def open(self, r: int, c: int):
+        """ Updates the field after the tile on cell (r, c) was removed. Costs can only go down, so only cells that got closer are revisited """
+        changed: list[tuple[int, grid.Cell]] = []
+        for ar in range(max(r - self._size + 1, 0), min(r + 1, self._rows)): # Every object position that covers the cell
+            for ac in range(max(c - self._size + 1, 0), min(c + 1, self._cols)):
+                i = ar*self._cols + ac
+                self._enter[i] = self._price(ar, ac)
+                if self._enter[i] == UNREACHABLE: continue
+                if self._distances[i] == UNREACHABLE: # It just became passable
+                    self._distances[i] = 0 if self._at_goal(ar, ac) else min(UNREACHABLE, min(self.cost(ar + dr, ac + dc) + self.distance(ar + dr, ac + dc) for _, dr, dc in STEPS))
+                if self._distances[i] != UNREACHABLE: changed.append((self._distances[i], (ar, ac)))
+        heapq.heapify(changed)
+        self._relax(changed)
+
+    def _price(self, r: int, c: int) -> int:
+        """ Cost of moving onto cell, from the tiles the object would cover """
+        price = 1
+        for code in (self._gridmap.tiles.code(r + dr, c + dc) for dr in range(self._size) for dc in range(self._size)):
+            if code and code not in self._costs: return UNREACHABLE
+            price += self._costs.get(code, 0)
+        return price
+
+    def _at_goal(self, r: int, c: int) -> bool:
+        """ Returns True if an object on cell would overlap the goal """
+        return any((r + dr, c + dc) in self._goal for dr in range(self._size) for dc in range(self._size))
+
+    def _relax(self, heap: list[tuple[int, grid.Cell]]):
+        """ Spreads distances from a heap of (distance, cell) to the neighbours of each cell, until nothing gets closer """
+        distances, enter, rows, cols = self._distances, self._enter, self._rows, self._cols
+        while heap:
+            d, (r, c) = heapq.heappop(heap)
+            if d > distances[r*cols + c]: continue # Already reached more cheaply
+            d += enter[r*cols + c] # Neighbours get here by moving onto this cell
+            for _, dr, dc in STEPS:
+                nr, nc = r + dr, c + dc
+                if 0 <= nr < rows and 0 <= nc < cols and enter[nr*cols + nc] != UNREACHABLE and d < distances[nr*cols + nc]:
+                    distances[nr*cols + nc] = d
+                    heapq.heappush(heap, (d, (nr, nc)))
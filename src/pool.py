@@ -0,0 +1,38 @@
+from collections import defaultdict
+from typing import Callable, Generic, Hashable, TypeVar
+""" Object pooling """
+
+K = TypeVar('K', bound=Hashable)
+T = TypeVar('T')
+
+class Pool(Generic[K, T]):
+    """
+    Free lists of reusable objects, grouped by a key describing what kind of object they are.
+    Released objects are handed out again by acquire, which only creates a new one when none of that kind is free.
+    Callers reset acquired objects themselves.
+    """
+    def __init__(self, capacity: int = 256) -> None:
+        self._capacity = capacity # Most free objects kept per key, 0 disables pooling
+        self._free: defaultdict[K, list[T]] = defaultdict(list)
+        self.created = 0
+        self.reused = 0
+
+    def __len__(self) -> int:
+        """ Returns the number of free objects """
+        return sum(map(len, self._free.values()))
+
+    def acquire(self, key: K, create: Callable[[], T]) -> T:
+        """ Returns a free object of the given kind, or a newly created one """
+        if free := self._free.get(key):
+            self.reused += 1
+            return free.pop()
+        self.created += 1
+        return create()
+
+    def release(self, key: K, obj: T):
+        """ Returns an object that is no longer in use to the pool """
+        if len(free := self._free[key]) < self._capacity: free.append(obj)
+
+    def clear(self):
+        """ Drops all free objects """
+        self._free.clear()
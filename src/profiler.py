@@ -0,0 +1,83 @@
+import csv
+import json
+from collections import deque
+from time import perf_counter
+from typing import Final, Sequence
+""" Per-phase timing of frames, to find out where the frame budget goes """
+
+PERCENTILES: Final[tuple[int, ...]] = (50, 95, 99)
+TOTAL: Final[str] = 'total' # Sum of every phase of a frame
+
+class Profiler:
+    """
+    Times the phases of every frame with laps: each lap charges the time since the previous one to a phase, so code is timed without being wrapped.
+    The last window frames are kept for percentiles, and every frame too if keep is set, to be saved as telemetry.
+    A disabled profiler times nothing, and laps cost a method call.
+    """
+    def __init__(self, window: int = 120, keep: bool = False, enabled: bool = True) -> None:
+        self._enabled = enabled
+        self._keep = keep
+        self._window: deque[dict[str, float]] = deque(maxlen=window)
+        self._frames: list[tuple[int, dict[str, float]]] = [] # (frame number, seconds per phase) of every frame kept
+        self._phases: dict[str, None] = {} # Ordered set of the phases seen, in the order they were first timed
+        self._current: dict[str, float] = {}
+        self._count = 0 # Frames ended so far
+        self._last = perf_counter()
+
+    @property
+    def enabled(self): return self._enabled
+    @enabled.setter
+    def enabled(self, value: bool):
+        """ Starts or stops timing. Timing starts over with a fresh frame """
+        self._enabled = value
+        self.reset()
+    @property
+    def phases(self):
+        """ Returns the phases timed so far """
+        return list(self._phases)
+    @property
+    def frames(self):
+        """ Returns the (frame number, seconds per phase) of every frame kept """
+        return self._frames
+
+    def reset(self):
+        """ Drops what was timed of the current frame and times the rest of it from now """
+        self._current = {}
+        self._last = perf_counter()
+
+    def lap(self, phase: str):
+        """ Charges the time since the last lap to a phase """
+        if not self._enabled: return
+        now = perf_counter()
+        self._current[phase] = self._current.get(phase, 0.0) + now - self._last
+        self._last = now
+
+    def frame(self):
+        """ Ends the current frame. The time since its last lap is left out, like the wait for the next frame, and a frame without laps isn't kept """
+        if not self._enabled: return
+        self._count += 1
+        if self._current:
+            self._phases.update(dict.fromkeys(self._current))
+            self._window.append(self._current)
+            if self._keep: self._frames.append((self._count, self._current))
+        self.reset()
+
+    def percentiles(self, phase: str, percentiles: Sequence[int] = PERCENTILES) -> list[float]:
+        """ Returns the percentiles of the milliseconds per frame of a phase, or of whole frames for TOTAL, over the last window frames """
+        times = sorted(sum(frame.values()) if phase == TOTAL else frame.get(phase, 0.0) for frame in self._window)
+        return [1000*times[min(len(times) - 1, len(times)*p//100)] if times else 0.0 for p in percentiles]
+
+    def summary(self) -> list[tuple[str, list[float]]]:
+        """ Returns the percentiles of every phase and of whole frames """
+        return [(phase, self.percentiles(phase)) for phase in (*self._phases, TOTAL)]
+
+    def save(self, path: str):
+        """ Writes the kept frames in milliseconds per phase, as JSON if path ends in .json and as CSV otherwise """
+        fields = ['frame', TOTAL, *self._phases]
+        rows = [{'frame': n, TOTAL: round(1000*sum(times.values()), 4), **{phase: round(1000*times.get(phase, 0.0), 4) for phase in self._phases}} for n, times in self._frames]
+        with open(path, 'w', newline='') as file:
+            if path.endswith('.json'): json.dump(rows, file, indent=1)
+            else:
+                writer = csv.DictWriter(file, fields)
+                writer.writeheader()
+                writer.writerows(rows)
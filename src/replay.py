@@ -0,0 +1,129 @@
+import sys
+import zlib
+import struct
+import argparse
+from array import array
+from time import perf_counter
+from dataclasses import dataclass, field
+from typing import Final, Protocol
+from controls import Input
+from profiler import Profiler
+""" Input recordings of play sessions, and a headless runner that replays them as fast as possible """
+
+REPLAY_MAGIC: Final[bytes] = b"BCRP"
+REPLAY_VERSION: Final[int] = 3 # Bumped whenever the same input stops playing out the same, so old replays are rejected instead of mismatching
+HEADER: Final[str] = "<4sHHQI8s" # magic, version, flags, seed, frames, final state hash
+SMART_ENEMIES: Final[int] = 1 # Flag of sessions played against smart enemies
+
+@dataclass
+class Replay:
+    """ The seed and mode of a session, the input of each of its frames, and the hash of its final state """
+    seed: int
+    frames: list[Input] = field(default_factory=list)
+    final_hash: str = ''
+    smart_enemies: bool = False
+
+    def dumps(self) -> bytes:
+        """ Encodes the replay. Frames are run-length encoded as (count, held, pressed) triples and compressed """
+        runs = array('I')
+        for inp in self.frames:
+            if runs and runs[-2] == inp.held and runs[-1] == inp.pressed: runs[-3] += 1
+            else: runs.extend((1, inp.held, inp.pressed))
+        if sys.byteorder == 'big': runs.byteswap()
+        header = struct.pack(HEADER, REPLAY_MAGIC, REPLAY_VERSION, SMART_ENEMIES if self.smart_enemies else 0, self.seed, len(self.frames), bytes.fromhex(self.final_hash))
+        return header + zlib.compress(runs.tobytes(), 9)
+
+    @classmethod
+    def loads(cls, data: bytes) -> 'Replay':
+        """ Decodes a replay """
+        magic, version = struct.unpack_from("<4sH", data) if len(data) >= 6 else (b'', 0)
+        if magic != REPLAY_MAGIC or version != REPLAY_VERSION: raise ValueError('Not a supported replay file')
+        _, _, flags, seed, count, final_hash = struct.unpack_from(HEADER, data)
+        runs = array('I', zlib.decompress(data[struct.calcsize(HEADER):]))
+        if sys.byteorder == 'big': runs.byteswap()
+        frames: list[Input] = []
+        for n in range(0, len(runs), 3):
+            frames += [Input(runs[n + 1], runs[n + 2])]*runs[n]
+        if len(frames) != count: raise ValueError('Replay file is corrupted')
+        return cls(seed, frames, final_hash.hex(), bool(flags & SMART_ENEMIES))
+
+    def save(self, path: str):
+        with open(path, 'wb') as file: file.write(self.dumps())
+
+    @classmethod
+    def load(cls, path: str) -> 'Replay':
+        with open(path, 'rb') as file: return cls.loads(file.read())
+
+class Recorder:
+    """ Records a session's per-frame input and saves it as a replay """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.replay = Replay(0)
+
+    def start(self, seed: int, smart_enemies: bool = False):
+        """ Starts a new recording of a session with the given seed and mode """
+        self.replay = Replay(seed, smart_enemies = smart_enemies)
+
+    def record(self, inp: Input):
+        """ Records the input of a frame """
+        self.replay.frames.append(inp)
+
+    def save(self, final_hash: str):
+        """ Saves the recording with the hash of the session's final state """
+        self.replay.final_hash = final_hash
+        self.replay.save(self.path)
+
+class Simulation(Protocol):
+    """ Anything that plays a session frame by frame, like main.Session """
+    @property
+    def state(self): ...
+    def update(self, inp: Input) -> None: ...
+
+@dataclass
+class Result:
+    """ Outcome of a replay run """
+    frames: int
+    seconds: float
+    final_hash: str
+    expected_hash: str
+
+    @property
+    def ok(self):
+        """ Returns True if the run ended in the recorded state """
+        return self.final_hash == self.expected_hash
+    @property
+    def fps(self): return self.frames/self.seconds if self.seconds else float('inf')
+
+def run(replay: Replay, session: Simulation, profile: Profiler | None = None) -> Result:
+    """ Feeds a replay's input to a session as fast as possible. The session has to be started with the replay's seed, and with profile if one is given to time its frames """
+    start = perf_counter()
+    if profile: profile.reset() # Leaves out starting the session
+    for inp in replay.frames:
+        session.update(inp)
+        if profile: profile.frame()
+    seconds = perf_counter() - start
+    return Result(len(replay.frames), seconds, session.state.state_hash(), replay.final_hash)
+
+if __name__ == "__main__":
+    import main, backends # main imports this module, so it can only be imported once this one is loaded
+    parser = argparse.ArgumentParser(description="Replays recordings headlessly, checks that each one ends in its recorded state and reports its speed")
+    parser.add_argument("replays", nargs="+", metavar="replay", help="replay files, recorded with `python main.py --record PATH`")
+    parser.add_argument("--telemetry", metavar="PATH", help="write the milliseconds each phase of each frame took, as JSON if PATH ends in .json and as CSV otherwise")
+    args = parser.parse_args()
+    if args.telemetry and len(args.replays) > 1: parser.error("--telemetry takes a single replay")
+    backend = backends.headless()
+    failed = 0
+    for path in args.replays:
+        try:
+            replay = Replay.load(path)
+        except ValueError as error: # Recorded by an older version of the game, or not a replay at all
+            print(f"{path}: {error}")
+            failed += 1
+            continue
+        profile = Profiler(keep = True) if args.telemetry else None
+        result = run(replay, main.Session(backend, replay.seed, replay.smart_enemies, profile), profile)
+        if profile: profile.save(args.telemetry)
+        failed += not result.ok
+        status = 'ok' if result.ok else f"MISMATCH (got {result.final_hash}, expected {result.expected_hash})"
+        print(f"{path}: {result.frames} frames in {result.seconds:.3f}s, {result.fps:.0f} frames/s, {status}")
+    sys.exit(1 if failed else 0)
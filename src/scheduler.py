@@ -0,0 +1,41 @@
+import heapq
+from itertools import count
+from typing import Callable, Hashable
+""" Frame-based timers """
+
+class Scheduler:
+    """
+    Runs callbacks a number of frames from now. Its owner advances it once per frame with tick(), 
+    so timing follows the simulation (pausing, fast-forwarding and headless runs) instead of the wall clock.
+    """
+    def __init__(self) -> None:
+        self._frame = 0
+        self._queue: list[tuple[int, int, Hashable, Callable[[], object]]] = [] # Heap of (due frame, insertion order, group, callback)
+        self._order = count()
+
+    @property
+    def frame(self): 
+        """ Returns the number of frames ticked so far """
+        return self._frame
+
+    def __len__(self) -> int:
+        """ Returns the number of pending callbacks """
+        return len(self._queue)
+
+    def after(self, frames: int, callback: Callable[[], object], group: Hashable = None):
+        """ Schedules a callback to run once the given number of frames have been ticked. Callbacks of a group can be cancelled together """
+        heapq.heappush(self._queue, (self._frame + frames, next(self._order), group, callback))
+
+    def tick(self):
+        """ Advances one frame and runs every callback that is due, in the order they were scheduled """
+        self._frame += 1
+        while self._queue and self._queue[0][0] <= self._frame:
+            *_, callback = heapq.heappop(self._queue)
+            callback()
+
+    def clear(self, group: Hashable = None):
+        """ Cancels all pending callbacks, or only those of a group """
+        if group is None: self._queue.clear()
+        else:
+            self._queue = [entry for entry in self._queue if entry[2] != group]
+            heapq.heapify(self._queue)
@@ -1,20 +1,26 @@
-import pyxel as px
-""" Sound bank """
+from types import ModuleType
+from typing import TypeAlias
+""" Sound bank. pyxel is imported by the sounds that play through it, so the Silent sound bank and headless runs don't need it installed """
 
 def arrow_shoot():
+    import pyxel as px
     px.play(2, 0)
 
 def arrow_collision():
+    import pyxel as px
     px.play(2, 2)
 
 def magic_arrow_shoot():
+    import pyxel as px
     px.play(3, 0)
     px.play(3, 1)
 
 def magic_arrow_collision():
+    import pyxel as px
     px.play(3, 3)
 
 def tank_explosion():
+    import pyxel as px
     px.sounds[4].set( # type: ignore
         "a2 a2 g2 f2 e2 e2",
         "n",
@@ -25,29 +31,57 @@ def tank_explosion():
     px.play(3, 4)
 
 def powered_up():
+    import pyxel as px
     px.play(3, 5)
 
 def game_over():
+    import pyxel as px
     px.play(3, 22)
 
 def won(loop: bool):
+    import pyxel as px
     px.play(3, 17, loop=loop)
 
 def main_menu():
+    import pyxel as px
     px.playm(2, loop=True)
 
 def level_1():
+    import pyxel as px
     px.playm(1, loop=True)
 
 def level_2(): # AMOGUS MAP
+    import pyxel as px
     px.playm(0, loop=True)
 
 def level_3():
+    import pyxel as px
     px.playm(3, loop=True)
 
 def level_4():
+    import pyxel as px
     px.playm(4, loop=True)
 
 def stop_bgm():
+    import pyxel as px
     px.stop(0)
-    px.stop(1)
\ No newline at end of file
+    px.stop(1)
+
+class Silent:
+    """ Sound bank that plays nothing, for headless runs. Mirrors the functions of this module """
+    def arrow_shoot(self): pass
+    def arrow_collision(self): pass
+    def magic_arrow_shoot(self): pass
+    def magic_arrow_collision(self): pass
+    def tank_explosion(self): pass
+    def powered_up(self): pass
+    def game_over(self): pass
+    def won(self, loop: bool): pass
+    def main_menu(self): pass
+    def level_1(self): pass
+    def level_2(self): pass
+    def level_3(self): pass
+    def level_4(self): pass
+    def stop_bgm(self): pass
+
+Audio: TypeAlias = ModuleType | Silent # This module or a Silent sound bank
@@ -1,5 +1,18 @@
-import pyxel as px
+import os
+import struct
+import hashlib
+import argparse
+import tomllib
+import zipfile
 import sounds
+from dataclasses import dataclass
+from typing import Final, Protocol, Sequence
+
+RESOURCE_FILE: Final[str] = os.path.join(os.path.dirname(os.path.abspath(__file__)), "my_resource.pyxres")
+PACK_MAGIC: Final[bytes] = b"BCLV"
+PACK_VERSION: Final[int] = 1
+MAP_BLOCK: Final[int] = 32 # Levels are sized in whole blocks of this many cells, one screen each way
+
 class WorldObjects:
     ''' Bank of the sprite module coordinates of each object in the tilemap '''
     BRICK: list[tuple[int, int]] = [(8, 2), (9, 2), (8, 3), (9, 3)]
@@ -15,65 +28,256 @@ class WorldObjects:
     CASTLE: list[tuple[int, int]] = [(8, 4)]
     POWERUP: list[tuple[int, int]] = [(8, 6), (10, 6)]
     
+class Tilemap(Protocol):
+    width: int
+    height: int
+    def pget(self, x: int, y: int) -> tuple[int, int]: ...
+
+class Tilemaps(Protocol):
+    ''' Source of the level tilemaps of a resource file, indexed by level. Sources without a file have no path '''
+    @property
+    def path(self) -> str | None: ...
+    def __getitem__(self, level: int) -> Tilemap: ...
+
+class PyxelTilemaps:
+    ''' Tilemaps of a resource file as loaded by pyxel '''
+    def __init__(self, path: str = RESOURCE_FILE):
+        self.path = path
+
+    def __getitem__(self, level: int) -> Tilemap:
+        import pyxel as px # Only needed to load levels through pyxel, not to parse or compile them
+        px.load(self.path)
+        return px.tilemaps[level] # pyxel is printing "pyxel.tilemap(tm) is deprecated, use pyxel.tilemaps[tm] instead"
+
+class ResourceTilemap:
+    ''' A tilemap read straight from a resource file. Tiles are stored as flattened (x, y) pairs per row, trailing zeroes trimmed '''
+    def __init__(self, data: list[list[int]]):
+        self.data = data
+        self.height = len(data)
+        self.width = max((len(row)//2 for row in data), default=0)
+
+    def pget(self, x: int, y: int) -> tuple[int, int]:
+        row = self.data[y] if 0 <= y < len(self.data) else []
+        return (row[2*x] if 2*x < len(row) else 0), (row[2*x + 1] if 2*x + 1 < len(row) else 0)
+
+class ResourceFile:
+    ''' Reads the tilemaps of a .pyxres resource file without pyxel, for headless runs. Rereads the file when it changes '''
+    FORMAT_VERSION = 3
+    def __init__(self, path: str = RESOURCE_FILE):
+        self.path = path
+        self._mtime: float | None = None
+        self._tilemaps: list[ResourceTilemap] = []
+
+    def __getitem__(self, level: int) -> Tilemap:
+        if self._mtime != (mtime := os.path.getmtime(self.path)):
+            with zipfile.ZipFile(self.path) as archive:
+                resource = tomllib.loads(archive.read("pyxel_resource.toml").decode())
+            if resource.get("format_version") != self.FORMAT_VERSION:
+                raise ValueError(f"Unsupported resource format version {resource.get('format_version')} in {self.path}")
+            self._tilemaps = [ResourceTilemap(tilemap["data"]) for tilemap in resource["tilemaps"]]
+            self._mtime = mtime
+        return self._tilemaps[level]
+
+# Tile to city character, built from the WorldObjects bank
+TILES: Final[dict[tuple[int, int], str]] = {tile: char for tiles, char in (
+    (WorldObjects.BRICK, 'B'), (WorldObjects.CRACKED_BRICK, 'R'), (WorldObjects.WATER, 'W'), (WorldObjects.STONE, 'S'),
+    (WorldObjects.TREE, 'T'), (WorldObjects.MIRROR1, 'L'), (WorldObjects.MIRROR2, 'J'), (WorldObjects.CASTLE, 'C'),
+    (WorldObjects.PLAYER, 'P'), (WorldObjects.ENEMY, 'E'), (WorldObjects.MAGIC_ENEMY, 'E'), (WorldObjects.POWERUP, '*'),
+) for tile in tiles}
+
+EMPTY: Final[tuple[int, int]] = (0, 0) # Blank tile, which is also the corner of the player sprite
+
+BLANK: Final[tuple[int, int]] = (2, 2) # A tile that is nothing, unlike EMPTY which the first time is the player
+CHAR_TILES: Final[dict[str, tuple[int, int]]] = {'.': BLANK, **{char: tile for tile, char in reversed(TILES.items())}} # City character to its first tile
+
+class CityTilemap:
+    ''' A city given as rows of characters, seen as a tilemap, so levels made outside the resource file load like any other '''
+    def __init__(self, city: Sequence[str]):
+        self.city = city
+        self.height = len(city)
+        self.width = len(city[0]) if city else 0
+
+    def pget(self, x: int, y: int) -> tuple[int, int]:
+        return CHAR_TILES.get(self.city[y][x], BLANK) if 0 <= y < self.height and 0 <= x < self.width else BLANK
+
+class Cities:
+    ''' Tilemaps of cities given as rows of characters, indexed by level. Nothing backs them on disk, so they are parsed again on every load '''
+    path = None
+    def __init__(self, cities: Sequence[Sequence[str]]):
+        self.cities = cities
+
+    def __getitem__(self, level: int) -> Tilemap:
+        return CityTilemap(self.cities[level])
+
+    def level(self, level: int) -> 'Level':
+        ''' Returns the parsed level, like parse() of its tilemap but with string operations on whole rows, so huge cities load quickly '''
+        city: list[str] = []
+        enemies_spawnpoint: list[tuple[int, int]] = []
+        powerups_spawnpoint: list[tuple[int, int]] = []
+        is_player_ingame: bool = False # 1 player instance
+        for i, row in enumerate(self.cities[level]):
+            row = ''.join(row)
+            if not CHAR_TILES.keys() >= set(row): row = ''.join(char if char in CHAR_TILES else '.' for char in row) # Unknown characters are blank, as in parse
+            enemies_spawnpoint += [(i, j) for j, char in enumerate(row) if char == 'E'] if 'E' in row else []
+            if '*' in row:
+                powerups_spawnpoint += [(i, j) for j, char in enumerate(row) if char == '*']
+                row = row.replace('*', '.')
+            if 'P' in row:
+                j = -1 if is_player_ingame else row.index('P')
+                row = row[:j + 1] + row[j + 1:].replace('P', '.')
+                is_player_ingame = True
+            city.append(row)
+        return Level(tuple(city), tuple(enemies_spawnpoint), tuple(powerups_spawnpoint))
+
+@dataclass(frozen=True)
+class Level:
+    ''' A parsed level: its city as rows of characters and the spawn points on it '''
+    city: tuple[str, ...]
+    enemies_spawnpoint: tuple[tuple[int, int], ...]
+    powerups_spawnpoint: tuple[tuple[int, int], ...]
+
+def measure(tilemap: Tilemap) -> tuple[int, int]:
+    ''' Returns the (rows, cols) of the level in a tilemap: the extent of its known tiles, rounded up to whole blocks of MAP_BLOCK cells '''
+    rows = cols = 1
+    for i in range(tilemap.height):
+        for j in range(tilemap.width):
+            if (tile := tilemap.pget(j, i)) != EMPTY and tile in TILES: rows, cols = max(rows, i + 1), max(cols, j + 1)
+    return -(-rows//MAP_BLOCK)*MAP_BLOCK, -(-cols//MAP_BLOCK)*MAP_BLOCK
+
+def parse(tilemap: Tilemap, rows: int | None = None, cols: int | None = None) -> Level:
+    ''' Generates the city of a tilemap, sized by measure() unless rows and cols are given '''
+    if rows is None or cols is None: rows, cols = measure(tilemap)
+    city: list[str] = []
+    enemies_spawnpoint: list[tuple[int, int]] = []
+    powerups_spawnpoint: list[tuple[int, int]] = []
+    is_player_ingame: bool = False # 1 player instance
+    for i in range(rows):
+        city_row: list[str] = []
+        for j in range(cols):
+            char = TILES.get(tilemap.pget(j, i), '.') # type: ignore
+            if char == 'P':
+                if is_player_ingame: char = '.'
+                is_player_ingame = True
+            elif char == 'E':
+                enemies_spawnpoint.append((i, j))
+            elif char == '*':
+                powerups_spawnpoint.append((i, j))
+                char = '.'
+            city_row.append(char)
+        city.append(''.join(city_row))
+    return Level(tuple(city), tuple(enemies_spawnpoint), tuple(powerups_spawnpoint))
+
+def pack_path(resource: str) -> str:
+    ''' Returns where the compiled levels of a resource file are stored '''
+    return os.path.splitext(resource)[0] + ".levels"
+
+def build_pack(tilemaps: Tilemaps, levels: range) -> bytes:
+    '''
+    Compiles levels into the pack format, stamped with a digest of their resource file. All integers are little endian.
+    Header: magic, version (u16), level count (u16), resource SHA-1 (20 bytes)
+    Per level: rows, cols, enemy and powerup spawn counts (u16 each), city characters (rows*cols bytes), spawn (row, col) pairs (u16 each)
+    '''
+    if tilemaps.path is None: raise ValueError('Only the tilemaps of a resource file can be packed')
+    with open(tilemaps.path, "rb") as file:
+        digest = hashlib.sha1(file.read()).digest()
+    chunks = [struct.pack("<4sHH20s", PACK_MAGIC, PACK_VERSION, len(levels), digest)]
+    for level in levels:
+        stage = parse(tilemaps[level])
+        spawns = stage.enemies_spawnpoint + stage.powerups_spawnpoint
+        chunks.append(struct.pack("<4H", len(stage.city), len(stage.city[0]), len(stage.enemies_spawnpoint), len(stage.powerups_spawnpoint)))
+        chunks.append("".join(stage.city).encode("ascii"))
+        chunks.append(struct.pack(f"<{2*len(spawns)}H", *(n for spawn in spawns for n in spawn)))
+    return b"".join(chunks)
+
+def read_pack(resource: str) -> list[Level] | None:
+    '''
+    Reads the compiled levels of a resource file in one go. Returns None if there are none, if the resource file changed since they were built,
+    or if the pack is truncated or corrupt, like one left behind by an interrupted build
+    '''
+    try:
+        with open(pack_path(resource), "rb") as file: data = file.read()
+        with open(resource, "rb") as file: digest = hashlib.sha1(file.read()).digest()
+    except FileNotFoundError:
+        return None
+    try: return unpack(data, digest)
+    except (struct.error, ValueError): return None # UnicodeDecodeError is a ValueError
+
+def unpack(data: bytes, digest: bytes) -> list[Level] | None:
+    ''' Decodes the levels of a pack built from a resource file with the given digest. Returns None if it was built from another one '''
+    header = struct.calcsize("<4sHH20s")
+    magic, version, count, source = struct.unpack_from("<4sHH20s", data)
+    if magic != PACK_MAGIC or version != PACK_VERSION or source != digest: return None
+    levels: list[Level] = []
+    offset = header
+    for _ in range(count):
+        rows, cols, enemies, powerups = struct.unpack_from("<4H", data, offset)
+        offset += 8
+        city = data[offset:offset + rows*cols].decode("ascii")
+        if len(city) != rows*cols or not cols: raise ValueError('Pack is truncated')
+        offset += rows*cols
+        spawns = struct.unpack_from(f"<{2*(enemies + powerups)}H", data, offset)
+        offset += 4*(enemies + powerups)
+        pairs = tuple(zip(spawns[::2], spawns[1::2]))
+        levels.append(Level(tuple(city[i:i + cols] for i in range(0, rows*cols, cols)), pairs[:enemies], pairs[enemies:]))
+    if offset != len(data): raise ValueError('Pack has trailing data')
+    return levels
+
+_levels: dict[tuple[str, int], tuple[float, Level]] = {} # (resource path, level) -> (resource mtime, parsed level)
+
+def load_level(level: int, tilemaps: Tilemaps) -> Level:
+    '''
+    Returns the parsed level. Each level is parsed once per process, and again only if its resource file changes.
+    Levels come from the compiled pack of the resource file when it is up to date, otherwise from its tilemaps.
+    '''
+    if isinstance(tilemaps, Cities): return tilemaps.level(level)
+    if (path := tilemaps.path) is None: return parse(tilemaps[level]) # Nothing on disk to cache it against
+    key, mtime = (path, level), os.path.getmtime(path)
+    if key not in _levels or _levels[key][0] != mtime:
+        for n, stage in enumerate(read_pack(path) or ()):
+            _levels[path, n] = mtime, stage
+        if key not in _levels or _levels[key][0] != mtime:
+            _levels[key] = mtime, parse(tilemaps[level])
+    return _levels[key][1]
+
 class MapLoader:
     LEVELS = 4
     ''' Generates the city for corresponding level '''
-    def __init__(self, level: int):
-        px.load("my_resource.pyxres")
+    def __init__(self, level: int, tilemaps: Tilemaps | None = None, audio: sounds.Audio = sounds):
         self.level = level
-        self.tilemap = px.tilemaps[self.level] # pyxel is printing "pyxel.tilemap(tm) is deprecated, use pyxel.tilemaps[tm] instead"
-        self.city: list[list[str]] = []
-        self.enemies_spawnpoint: list[tuple[int, int]] = []
-        self.powerups_spawnpoint: list[tuple[int, int]] = []
-        is_player_ingame: bool = False # 1 player instance
-        for i in range(32):
-            city_row: list[str] = []
-            for j in range(32):
-                tile: tuple[int, int] = self.tilemap.pget(j, i) # type: ignore
-                if tile in WorldObjects.BRICK: city_row.append('B')
-                elif tile in WorldObjects.CRACKED_BRICK: city_row.append('R')
-                elif tile in WorldObjects.WATER: city_row.append('W')
-                elif tile in WorldObjects.STONE: city_row.append('S')
-                elif tile in WorldObjects.TREE: city_row.append('T')
-                elif tile in WorldObjects.MIRROR1: city_row.append('L')
-                elif tile in WorldObjects.MIRROR2: city_row.append('J')
-                elif tile in WorldObjects.CASTLE: city_row.append('C')
-                elif tile in WorldObjects.PLAYER:
-                    if not is_player_ingame:
-                        city_row.append('P')
-                        is_player_ingame = True
-                    else:
-                        city_row.append('.')
-                elif tile in WorldObjects.ENEMY or tile in WorldObjects.MAGIC_ENEMY:
-                    city_row.append('E')
-                    self.enemies_spawnpoint.append((i, j))
-                elif tile in WorldObjects.POWERUP:
-                    self.powerups_spawnpoint.append((i, j))
-                    city_row.append('.')
-                else:
-                    city_row.append('.')
-            
-            self.city.append(city_row)
+        self.audio = audio
+        stage = load_level(level, tilemaps if tilemaps is not None else PyxelTilemaps())
+        self.city: list[str] = list(stage.city) # Rows are strings, which take a byte per cell
+        self.enemies_spawnpoint: list[tuple[int, int]] = list(stage.enemies_spawnpoint)
+        self.powerups_spawnpoint: list[tuple[int, int]] = list(stage.powerups_spawnpoint)
     
-    def load(self) -> list[list[str]]:
+    def load(self) -> list[str]:
         ''' Returns the generated city '''
-        sounds.stop_bgm()
+        self.audio.stop_bgm()
         if self.level == 0:
-            sounds.main_menu()
+            self.audio.main_menu()
         elif self.level == 1:
-            sounds.level_1()
+            self.audio.level_1()
         elif self.level == 2:
-            sounds.level_2()
+            self.audio.level_2()
         elif self.level == 3:
-            sounds.level_3()
+            self.audio.level_3()
         elif self.level == 4:
-            sounds.level_4()
+            self.audio.level_4()
         elif self.level == 5:
-            sounds.won(True)
+            self.audio.won(True)
         return self.city
     
     def enemy_location(self) -> list[tuple[int, int]]:
         return self.enemies_spawnpoint
     
     def power_up_location(self) -> list[tuple[int, int]]:
-        return self.powerups_spawnpoint
\ No newline at end of file
+        return self.powerups_spawnpoint
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compiles the levels of a resource file into a pack that the game loads at startup")
+    parser.add_argument("resource", nargs="?", default=RESOURCE_FILE, help="pyxel resource file (default: my_resource.pyxres)")
+    args = parser.parse_args()
+    tilemaps = ResourceFile(args.resource)
+    pack = build_pack(tilemaps, range(MapLoader.LEVELS + 2)) # Main menu, the levels and the credits
+    with open(pack_path(args.resource), "wb") as file: file.write(pack)
+    print(f"Wrote {len(pack)} bytes to {pack_path(args.resource)}")
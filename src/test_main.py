@@ -0,0 +1,34 @@
+import main
+import backends
+from main import TICK_RATE, AttackBoost, DefenseBoost, GameState
+
+def game() -> GameState:
+    return GameState(1, backends.headless(), seed=1)
+
+def test_powerup_survives_next_level():
+    state = game()
+    state.powerup(state.player, AttackBoost(), 2)
+    for _ in range(TICK_RATE): state.update()
+    state.next_level()
+    assert [type(power) for power in state.player.powerups] == [AttackBoost]
+    assert state.player.bullet_kind[0] is main.MagicArrow
+    for _ in range(TICK_RATE): state.update() # What was left of its duration
+    assert not state.player.powerups
+    assert state.player.bullet_kind[0] is main.Arrow
+
+def test_cheats_survive_reset_and_next_level():
+    state = game()
+    state.powerup(state.player, DefenseBoost(), 10**6) # As typed with UNDYING_CHEAT_CODE
+    state.powerup(state.player, AttackBoost(), 10**6) # As typed with MAGIC_CHEAT_CODE
+    for restart in (state.reset_level, state.next_level, state.reset_level):
+        restart()
+        for _ in range(TICK_RATE): state.update()
+        assert {type(power) for power in state.player.powerups} == {DefenseBoost, AttackBoost}
+        assert state.player.invulnerable
+
+def test_reset_cancels_the_timers_of_the_level():
+    state = game()
+    state.scheduler.after(TICK_RATE, lambda: setattr(state, 'lives', 0), main.LEVEL_TIMERS) # Like the game over of a destroyed castle
+    state.reset_level()
+    for _ in range(2*TICK_RATE): state.update()
+    assert not state.is_gameover
@@ -0,0 +1,33 @@
+import shutil
+import pytest
+import stage_file
+from pathlib import Path
+
+LEVELS = range(stage_file.MapLoader.LEVELS + 2)
+
+@pytest.fixture
+def resource(tmp_path: Path) -> str:
+    """ A copy of the resource file with a freshly built pack next to it """
+    path = str(tmp_path/"my_resource.pyxres")
+    shutil.copy(stage_file.RESOURCE_FILE, path)
+    with open(stage_file.pack_path(path), "wb") as file: file.write(stage_file.build_pack(stage_file.ResourceFile(path), LEVELS))
+    return path
+
+def test_read_pack(resource: str):
+    tilemaps = stage_file.ResourceFile(resource)
+    assert stage_file.read_pack(resource) == [stage_file.parse(tilemaps[level]) for level in LEVELS]
+
+@pytest.mark.parametrize("cut", [1, 20, 30, 37, 100, 1000, -1])
+def test_truncated_pack_falls_back_to_the_resource_file(resource: str, cut: int):
+    pack = stage_file.pack_path(resource)
+    with open(pack, "rb") as file: data = file.read()
+    with open(pack, "wb") as file: file.write(data[:cut])
+    assert stage_file.read_pack(resource) is None
+    assert stage_file.load_level(1, stage_file.ResourceFile(resource)) == stage_file.parse(stage_file.ResourceFile(resource)[1])
+
+def test_corrupt_pack(resource: str):
+    pack = stage_file.pack_path(resource)
+    with open(pack, "r+b") as file:
+        file.seek(40) # Within the city text of the first level
+        file.write(b"\xff")
+    assert stage_file.read_pack(resource) is None